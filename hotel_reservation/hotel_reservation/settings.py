@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
 
@@ -40,11 +42,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'reservation',
     'rest_framework',
-    'rest_framework_simplejwt'
+    'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
+    'reservation.metrics.RequestMetricsMiddleware',
+    'reservation.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'reservation.db.ReplicaReadsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,12 +83,52 @@ WSGI_APPLICATION = 'hotel_reservation.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment. DB_ENGINE=postgres selects PostgreSQL; anything else
+# falls back to the local SQLite file, tuned for concurrent access (WAL, busy timeout,
+# write lock taken at BEGIN so booking transactions queue instead of deadlocking).
+#
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   connection details
+#   DB_CONN_MAX_AGE       seconds to keep a persistent connection (default 60)
+#   DB_POOL_MAX_SIZE      > 0 enables the psycopg connection pool instead of persistent connections
+#   DB_REPLICA_HOSTS      comma-separated read replicas, used for GET/HEAD/OPTIONS requests
+
+if os.environ.get('DB_ENGINE', 'sqlite') == 'postgres':
+    def postgres(host):
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'hotel_reservation'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        pool_size = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+        if pool_size:
+            # pooled connections are returned to the pool per request, so they cannot also be persistent
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS']['pool'] = {'min_size': min(2, pool_size), 'max_size': pool_size, 'timeout': 10}
+        return database
+
+    DATABASES = {'default': postgres(os.environ.get('DB_HOST', 'localhost'))}
+    for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{index}'] = {**postgres(host.strip()), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
     }
-}
+
+DATABASE_ROUTERS = ['reservation.db.PrimaryReplicaRouter']
 
 
 # Password validation
@@ -121,6 +167,60 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory is per process; point CATALOGUE_CACHE_ALIAS at a shared backend (Redis/Memcached) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hotel-reservation',
+    }
+}
+
+CATALOGUE_CACHE_ALIAS = 'default'
+CATALOGUE_CACHE_TIMEOUT = 300
+# The fields permission checks read from the JWT user are cached too, see reservation/authentication.py.
+AUTH_USER_CACHE_TIMEOUT = 300
+
+# Payment gateway callbacks are queued and applied in batches: 'thread' runs the worker inside
+# the web process, 'command' leaves it to `manage.py process_payment_callbacks`.
+
+PAYMENT_CALLBACK_WORKER = os.environ.get('PAYMENT_CALLBACK_WORKER', 'thread')
+
+# Background jobs (reservation/jobs.py) are run by `manage.py run_jobs`. A job whose worker
+# dies is picked up again after JOB_LEASE_SECONDS; one that fails is retried up to
+# JOB_MAX_ATTEMPTS times. Unpaid, non-cash bookings are cancelled BOOKING_PAYMENT_TIMEOUT
+# minutes after they were made (reservation/lifecycle.py).
+
+JOB_LEASE_SECONDS = 600
+JOB_MAX_ATTEMPTS = 3
+BOOKING_PAYMENT_TIMEOUT = int(os.environ.get('BOOKING_PAYMENT_TIMEOUT', 30))
+
+# Request metrics (reservation/metrics.py): per-view latency and query totals are served at
+# /metrics/ in the Prometheus format. Set METRICS_TOKEN to require it as a bearer token; with
+# no token it is only served to the addresses in INTERNAL_IPS, e.g. INTERNAL_IPS=127.0.0.1 for
+# a scraper on the same host (none by default).
+# Queries slower than SLOW_QUERY_MS are logged with the application frames that ran them;
+# set it to an empty string to turn slow-query logging off.
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+INTERNAL_IPS = list(filter(None, os.environ.get('INTERNAL_IPS', '').split(',')))
+SLOW_QUERY_MS = os.environ.get('SLOW_QUERY_MS', '200')
+SLOW_QUERY_MS = float(SLOW_QUERY_MS) if SLOW_QUERY_MS else None
+SLOW_QUERY_STACK_DEPTH = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'reservation.slow_queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -128,10 +228,25 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'reservation.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'reservation.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': 20,
+    'DEFAULT_RENDERER_CLASSES': [
+        'reservation.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Responses are JSON (written by orjson when it is installed), or msgpack for clients that send
+# Accept: application/msgpack when the msgpack package is installed; see reservation/renderers.py.
+# They are compressed with brotli or gzip as Accept-Encoding allows (reservation/compression.py).
+# List and detail endpoints take ?fields=a,b or ?omit=c to return only some fields
+# (reservation/sparse.py).
+if find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'reservation.renderers.MessagePackRenderer')
+BROTLI_QUALITY = 5
+
 AUTH_USER_MODEL = 'reservation.User'
 
 SIMPLE_JWT = {
@@ -142,4 +257,17 @@ SIMPLE_JWT = {
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # blacklist checks go through a bloom filter, see reservation/tokens.py
+    "TOKEN_OBTAIN_SERIALIZER": "reservation.tokens.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "reservation.tokens.TokenRefreshSerializer",
 }
+
+# Sizing of the per-process bloom filter of blacklisted refresh tokens (about 1.8MB at the
+# defaults); it is rebuilt at twice the size if more tokens than this are blacklisted.
+TOKEN_BLACKLIST_CAPACITY = 1_000_000
+TOKEN_BLACKLIST_ERROR_RATE = 0.001
+# 'thread' loads the filter in the background on a process's first refresh, which meanwhile
+# checks the database; 'inline' loads it within that request. Blacklist ids skipped over by
+# a sync are re-read for TOKEN_BLACKLIST_SYNC_GRACE seconds in case they commit late.
+TOKEN_BLACKLIST_LOAD = os.environ.get('TOKEN_BLACKLIST_LOAD', 'thread')
+TOKEN_BLACKLIST_SYNC_GRACE = int(os.environ.get('TOKEN_BLACKLIST_SYNC_GRACE', 60))
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Hotel, Review, Room, Booking, Payment
+from .models import User, Hotel, Review, Room, Booking, Payment, PaymentCallback, Job, RatePlan, StayDiscount, OccupancySurge
 
 # Register your models here.
 
@@ -9,4 +9,9 @@ admin.site.register(Review)
 admin.site.register(Room)
 admin.site.register(Booking)
 admin.site.register(Payment)
+admin.site.register(PaymentCallback)
+admin.site.register(Job)
 
+admin.site.register(RatePlan)
+admin.site.register(StayDiscount)
+admin.site.register(OccupancySurge)
@@ -0,0 +1,342 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+try:
+    import numpy
+except ImportError:  # the live path falls back to plain Python
+    numpy = None
+
+from .models import Booking, Payment, Room, HotelDailyStat, RoomDailyStat
+
+## Occupancy and revenue analytics.
+##
+## Every active booking adds, for each night of its stay, one sold room-night and its nightly
+## revenue to HotelDailyStat and RoomDailyStat; a completed payment adds its nightly share of the
+## amount paid to paid_revenue, which moves with the stay when its dates change. Nights get an
+## even share in cents and the last night the remainder, so the nights of a stay add up to its
+## amount exactly. Signals (see signals.py) keep the rollups in step as bookings and payments
+## change, so reports read at most one row per hotel or room per day.
+##
+##   occupancy = room-nights sold / room-nights available
+##   ADR       = revenue / room-nights sold
+##   RevPAR    = revenue / room-nights available
+
+CENT = Decimal('0.01')
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def nightly(amount, nights):
+    return (Decimal(amount) / nights).quantize(CENT) if nights else Decimal(0)
+
+
+def last_night(amount, nights):
+    ## what is left for the last night after the others took nightly() each
+    return Decimal(amount) - nightly(amount, nights) * (nights - 1) if nights else Decimal(0)
+
+
+def _segments(check_in, check_out, revenue, paid):
+    ## the stay's nights as (first day, end day, nightly revenue, nightly paid) runs
+    nights = (check_out - check_in).days
+    last = check_out - ONE_DAY
+    rates = (nightly(revenue, nights), nightly(paid, nights))
+    last_rates = (last_night(revenue, nights), last_night(paid, nights))
+    if rates == last_rates:
+        return [(check_in, check_out, *rates)]
+    runs = [(check_in, last, *rates), (last, check_out, *last_rates)]
+    return [run for run in runs if run[0] < run[1]]
+
+
+def _increments(sold, revenue, paid):
+    return {
+        'nights_sold': F('nights_sold') + sold,
+        'revenue': F('revenue') + revenue,
+        'paid_revenue': F('paid_revenue') + paid,
+    }
+
+
+def apply_stays(stays):
+    """
+    Add per-night figures to both rollups. ``stays`` holds tuples of
+    (hotel_id, room_id, check_in, check_out, sold, revenue, paid revenue), with the revenue
+    of the whole stay; negative values take a stay back out. Stays that share dates and
+    amounts, such as a group booking, are folded into one UPDATE per table.
+    """
+    hotel_nights = defaultdict(lambda: [0, Decimal(0), Decimal(0)])
+    room_groups = defaultdict(list)
+    room_hotels = {}
+    for hotel_id, room_id, check_in, check_out, sold, revenue, paid in stays:
+        for day, end, night_revenue, night_paid in _segments(check_in, check_out, revenue, paid):
+            while day < end:
+                totals = hotel_nights[(hotel_id, day)]
+                totals[0] += sold
+                totals[1] += night_revenue
+                totals[2] += night_paid
+                day += ONE_DAY
+        room_groups[(check_in, check_out, sold, revenue, paid)].append(room_id)
+        room_hotels[room_id] = hotel_id
+    if not hotel_nights:
+        return
+
+    hotel_groups = defaultdict(lambda: defaultdict(list))
+    for (hotel_id, day), totals in hotel_nights.items():
+        hotel_groups[tuple(totals)][hotel_id].append(day)
+
+    with transaction.atomic():
+        ## only additions need rows to exist; removals update rows their stay created, and
+        ## must not recreate rows whose room or hotel is being deleted
+        HotelDailyStat.objects.bulk_create(
+            [HotelDailyStat(hotel_id=hotel_id, date=day) for (hotel_id, day), totals in hotel_nights.items() if max(totals) > 0],
+            ignore_conflicts=True,
+        )
+        RoomDailyStat.objects.bulk_create([
+            RoomDailyStat(room_id=room_id, hotel_id=room_hotels[room_id], date=check_in + ONE_DAY * offset)
+            for (check_in, check_out, *figures), room_ids in room_groups.items() if max(figures) > 0
+            for room_id in room_ids
+            for offset in range((check_out - check_in).days)
+        ], ignore_conflicts=True)
+
+        for (sold, revenue, paid), hotels in hotel_groups.items():
+            where = reduce(or_, (Q(hotel_id=hotel_id, date__in=days) for hotel_id, days in hotels.items()))
+            HotelDailyStat.objects.filter(where).update(**_increments(sold, revenue, paid))
+        for (check_in, check_out, sold, revenue, paid), room_ids in room_groups.items():
+            for day, end, night_revenue, night_paid in _segments(check_in, check_out, revenue, paid):
+                RoomDailyStat.objects.filter(room_id__in=room_ids, date__gte=day, date__lt=end).update(
+                    **_increments(sold, night_revenue, night_paid)
+                )
+
+
+def hotel_ids_for(room_ids, bookings=()):
+    ## rooms already loaded on the bookings cost nothing; the rest take one query
+    known = {}
+    for booking in bookings:
+        room = booking._state.fields_cache.get('room')
+        if room is not None and 'hotel_id' in room.__dict__:
+            known[room.pk] = room.hotel_id
+    missing = set(room_ids) - set(known)
+    if missing:
+        known.update(Room.objects.filter(pk__in=missing).values_list('pk', 'hotel_id'))
+    return known
+
+
+def _apply_keys(keys, bookings, paid=0):
+    ## keys: [(Booking.stay_key(), +1 or -1)]; stays of rooms that no longer exist are skipped
+    hotel_ids = hotel_ids_for({key[0] for key, _ in keys}, bookings)
+    stays = []
+    for (room_id, check_in, check_out, nights, total_amount), sign in keys:
+        if room_id in hotel_ids:
+            stays.append((hotel_ids[room_id], room_id, check_in, check_out, sign, sign * Decimal(total_amount), sign * Decimal(paid)))
+    apply_stays(stays)
+
+
+def paid_amount(booking):
+    ## the amount of the booking's completed payment, or 0; a payment already loaded costs nothing
+    payment = booking._state.fields_cache.get('payment')
+    if payment is not None:
+        return payment.amount if payment.status == 'COMPLETED' and payment.amount else 0
+    return Payment.objects.filter(booking_id=booking.pk, status='COMPLETED').values_list('amount', flat=True).first() or 0
+
+
+def record_booking_change(booking, previous):
+    ## previous is the booking's stay_key() as loaded (None for a new or inactive booking)
+    current = booking.stay_key()
+    if previous == current:
+        return
+    ## a stay that moves takes its paid share with it; payments and the refund sweep see to
+    ## the paid share of bookings that start or stop holding rooms
+    paid = paid_amount(booking) if previous is not None and current is not None else 0
+    _apply_keys([(key, sign) for key, sign in ((previous, -1), (current, 1)) if key is not None], [booking], paid)
+
+
+def record_booking_removed(booking, previous):
+    if previous is not None:
+        _apply_keys([(previous, -1)], [booking])
+
+
+def record_stays_removed(keys):
+    ## keys: stay_key() tuples of bookings cancelled by a bulk UPDATE, which sends no post_save
+    _apply_keys([(key, -1) for key in keys], ())
+
+
+def record_new_bookings(bookings):
+    _apply_keys([(key, 1) for key in (booking.stay_key() for booking in bookings) if key is not None], bookings)
+
+
+def record_payments(changes):
+    ## changes: [(booking_id, amount, +1 when it became COMPLETED / -1 when it stopped being)]
+    changes = [(booking_id, amount, sign) for booking_id, amount, sign in changes if amount]
+    if not changes:
+        return
+    bookings = Booking.objects.filter(pk__in={booking_id for booking_id, _, _ in changes}).values_list(
+        'pk', 'room_id', 'room__hotel_id', 'checked_in_date', 'checked_out_date',
+    )
+    stays = {pk: rest for pk, *rest in bookings}
+    apply_stays([
+        (hotel_id, room_id, check_in, check_out, 0, Decimal(0), sign * Decimal(amount))
+        for booking_id, amount, sign in changes if booking_id in stays
+        for room_id, hotel_id, check_in, check_out in [stays[booking_id]]
+    ])
+
+
+def rebuild(hotel_ids=None, batch_size=1000):
+    """Recompute the rollups from bookings and payments, for every hotel or only ``hotel_ids``."""
+    bookings = Booking.objects.filter(status__in=Booking.ACTIVE_STATUSES).order_by()
+    hotel_stats, room_stats = HotelDailyStat.objects.all(), RoomDailyStat.objects.all()
+    if hotel_ids is not None:
+        bookings = bookings.filter(room__hotel_id__in=hotel_ids)
+        hotel_stats, room_stats = hotel_stats.filter(hotel_id__in=hotel_ids), room_stats.filter(hotel_id__in=hotel_ids)
+
+    rows = bookings.values_list(
+        'room__hotel_id', 'room_id', 'checked_in_date', 'checked_out_date', 'total_amount', 'payment__status', 'payment__amount',
+    )
+    with transaction.atomic():
+        hotel_stats.delete()
+        room_stats.delete()
+        batch, count = [], 0
+        for hotel_id, room_id, check_in, check_out, total_amount, payment_status, amount in rows.iterator(chunk_size=batch_size):
+            ## the amount paid, as record_payments() adds it; it is not repriced with the booking
+            paid = (amount or Decimal(0)) if payment_status == 'COMPLETED' else Decimal(0)
+            batch.append((hotel_id, room_id, check_in, check_out, 1, total_amount, paid))
+            if len(batch) == batch_size:
+                apply_stays(batch)
+                count += len(batch)
+                batch = []
+        apply_stays(batch)
+    return count + len(batch)
+
+
+## Reports
+
+def metrics(available, sold, revenue, paid_revenue):
+    ## money is rendered as strings, like the DecimalFields of the API serializers
+    return {
+        'room_nights_available': available,
+        'room_nights_sold': sold,
+        'occupancy': round(sold / available, 4) if available else 0.0,
+        'adr': str((revenue / sold).quantize(CENT) if sold else Decimal('0.00')),
+        'revpar': str((revenue / available).quantize(CENT) if available else Decimal('0.00')),
+        'revenue': str(Decimal(revenue).quantize(CENT)),
+        'paid_revenue': str(Decimal(paid_revenue).quantize(CENT)),
+    }
+
+
+def period_start(day, period):
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def hotel_report(hotel, start, end, period='day'):
+    """Summary and a day/week/month series for ``start``..``end`` (inclusive), from the rollups."""
+    rooms = hotel.rooms.count()
+    daily = dict(
+        (day, (sold, revenue, paid))
+        for day, sold, revenue, paid in HotelDailyStat.objects.filter(hotel=hotel, date__range=(start, end))
+        .values_list('date', 'nights_sold', 'revenue', 'paid_revenue')
+    )
+    buckets = defaultdict(lambda: [0, 0, Decimal(0), Decimal(0)])
+    day = start
+    while day <= end:
+        sold, revenue, paid = daily.get(day, (0, Decimal(0), Decimal(0)))
+        bucket = buckets[period_start(day, period)]
+        bucket[0] += rooms
+        bucket[1] += sold
+        bucket[2] += revenue
+        bucket[3] += paid
+        day += ONE_DAY
+
+    totals = [sum(column) for column in zip(*buckets.values())] if buckets else [0, 0, Decimal(0), Decimal(0)]
+    return {
+        'hotel': hotel.pk,
+        'start': start,
+        'end': end,
+        'rooms': rooms,
+        'summary': metrics(*totals),
+        'series': [{'period': key, **metrics(*bucket)} for key, bucket in sorted(buckets.items())],
+    }
+
+
+def room_report(hotel, start, end):
+    """Per-room metrics for ``start``..``end`` (inclusive), from the rollups."""
+    days = (end - start).days + 1
+    totals = {
+        row['room']: row
+        for row in RoomDailyStat.objects.filter(hotel=hotel, date__range=(start, end))
+        .values('room').order_by()
+        .annotate(sold=Sum('nights_sold'), revenue=Sum('revenue'), paid=Sum('paid_revenue'))
+    }
+    report = []
+    for room_id, room_number in hotel.rooms.values_list('pk', 'room_number'):
+        row = totals.get(room_id, {})
+        report.append({
+            'room': room_id,
+            'room_number': room_number,
+            **metrics(days, row.get('sold') or 0, row.get('revenue') or Decimal(0), row.get('paid') or Decimal(0)),
+        })
+    return report
+
+
+def live_room_report(hotel, start, end):
+    """
+    The same per-room figures as room_report(), computed straight from the bookings that
+    overlap the range. Stays are clipped to the range as whole arrays when NumPy is installed,
+    so an ad-hoc range needs no rollups and no per-night Python loop.
+    """
+    end_exclusive = end + ONE_DAY
+    days = (end - start).days + 1
+    rooms = list(hotel.rooms.values_list('pk', 'room_number'))
+    index = {room_id: position for position, (room_id, _) in enumerate(rooms)}
+    rows = list(
+        Booking.objects.filter(room__hotel=hotel).overlapping(start, end_exclusive)
+        .values_list('room_id', 'checked_in_date', 'checked_out_date', 'nights', 'total_amount', 'payment__status', 'payment__amount')
+    )
+    ## the paid share is spread over the nights like the revenue, as the rollups do
+    rows = [
+        (room_id, check_in, check_out, count, total, (amount or 0) if status == 'COMPLETED' else 0)
+        for room_id, check_in, check_out, count, total, status, amount in rows
+    ]
+
+    if numpy is not None and rows:
+        room_ids, check_ins, check_outs, nights, totals, paid_amounts = zip(*rows)
+        positions = numpy.array([index[room_id] for room_id in room_ids])
+        first = numpy.maximum(numpy.array([day.toordinal() for day in check_ins]), start.toordinal())
+        last = numpy.minimum(numpy.array([day.toordinal() for day in check_outs]), end_exclusive.toordinal())
+        sold = numpy.clip(last - first, 0, None)
+        ## the last night's remainder counts for the stays whose last night is in the range
+        ends_inside = numpy.array([day.toordinal() for day in check_outs]) <= end_exclusive.toordinal()
+
+        def spread(amounts):
+            rates = numpy.array([float(nightly(amount, count)) for amount, count in zip(amounts, nights)])
+            remainders = numpy.array([float(last_night(amount, count) - nightly(amount, count)) for amount, count in zip(amounts, nights)])
+            return sold * rates + ends_inside * remainders
+
+        sold_by_room = numpy.bincount(positions, weights=sold, minlength=len(rooms))
+        revenue_by_room = numpy.bincount(positions, weights=spread(totals), minlength=len(rooms))
+        paid_by_room = numpy.bincount(positions, weights=spread(paid_amounts), minlength=len(rooms))
+        per_room = [
+            (int(sold_by_room[i]), Decimal(str(round(revenue_by_room[i], 2))), Decimal(str(round(paid_by_room[i], 2))))
+            for i in range(len(rooms))
+        ]
+    else:
+        per_room = [[0, Decimal(0), Decimal(0)] for _ in rooms]
+        for room_id, check_in, check_out, count, total, paid in rows:
+            sold = (min(check_out, end_exclusive) - max(check_in, start)).days
+            ends_inside = check_out <= end_exclusive
+            figures = per_room[index[room_id]]
+            figures[0] += sold
+            for position, amount in ((1, total), (2, paid)):
+                figures[position] += sold * nightly(amount, count)
+                if ends_inside:
+                    figures[position] += last_night(amount, count) - nightly(amount, count)
+
+    return [
+        {'room': room_id, 'room_number': room_number, **metrics(days, *per_room[index[room_id]])}
+        for room_id, room_number in rooms
+    ]
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ReservationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservation'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import lifecycle, signals  # noqa: F401
+        from .metrics import instrument
+        connection_created.connect(instrument)
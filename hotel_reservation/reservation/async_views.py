@@ -0,0 +1,73 @@
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .views import HotelView, RoomView, ReviewView
+
+## Async, read-only twins of the catalogue endpoints for the ASGI application (asgi.py).
+## Each one builds the DRF view it mirrors and takes its queryset, filters (?location=,
+## ?min_rating=, ?ordering=, ...), ?fields= / ?omit= narrowing, cursor paginator and serializer
+## from it, so both answer the same query string with the same JSON. Only the rows are fetched
+## here, with one awaited query; serializing them never touches the database from the event loop.
+
+
+def respond(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def mirror(view_class, request, action, **kwargs):
+    ## the sync view, set up as its dispatch() would before the handler runs
+    return view_class(request=Request(request), action=action, args=(), kwargs=kwargs, format_kwarg=None)
+
+
+async def page(view):
+    paginator = view.paginator
+    queryset = view.filter_queryset(view.get_queryset())
+    rows = [row async for row in paginator.page_query(queryset, view.request, view)]
+    data = view.get_serializer(paginator.set_page(rows), many=True).data
+    return paginator.get_paginated_response(data).data
+
+
+async def detail(view, pk):
+    queryset = view.get_queryset()
+    try:
+        instance = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        return respond({'detail': f'No {queryset.model._meta.object_name} matches the given query.'}, status=404)
+    return respond(view.get_serializer(instance).data)
+
+
+def catalogue_view(view):
+    async def wrapped(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            return respond(exc.detail, status=exc.status_code)
+    return require_safe(wrapped)
+
+
+@catalogue_view
+async def hotel_list(request):
+    return respond(await page(mirror(HotelView, request, 'list')))
+
+
+@catalogue_view
+async def hotel_detail(request, pk):
+    return await detail(mirror(HotelView, request, 'retrieve', pk=pk), pk)
+
+
+@catalogue_view
+async def room_list(request, hotel_pk):
+    return respond(await page(mirror(RoomView, request, 'list', hotel_pk=hotel_pk)))
+
+
+@catalogue_view
+async def review_list(request, hotel_pk):
+    return respond(await page(mirror(ReviewView, request, 'list', hotel_pk=hotel_pk)))
+
+
+@catalogue_view
+async def review_detail(request, hotel_pk, pk):
+    return await detail(mirror(ReviewView, request, 'retrieve', hotel_pk=hotel_pk, pk=pk), pk)
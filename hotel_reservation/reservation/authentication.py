@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import catalogue_cache
+from .models import User
+
+## JWT authentication with the user lookup cached.
+##
+## Every authenticated request used to fetch its User by primary key only for the permission
+## classes to read role/is_staff. The fields those checks use are cached per user; the request
+## gets a User built from them, with every other field deferred, so code that reads e.g. the
+## email still loads it on access. signals.py forgets the entry when the user is saved or deleted.
+
+## in model field order, which is the order Model.from_db() expects the values in
+CACHED_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'username', 'role', 'is_staff', 'is_superuser', 'is_active'}
+)
+
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    ## after commit, so a request racing the change cannot cache the old row again
+    transaction.on_commit(lambda: catalogue_cache().delete(_key(user_id)))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cache = catalogue_cache()
+        values = cache.get(_key(user_id))
+        if values is None:
+            values = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*CACHED_FIELDS).first()
+            if values is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(_key(user_id), values, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+
+        user = User.from_db(DEFAULT_DB_ALIAS, CACHED_FIELDS, values)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            ## the password hash is not cached; this reads it from the database
+            return super().get_user(validated_token)
+        return user
@@ -0,0 +1,164 @@
+import datetime
+import json
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+
+from . import geo, search
+from .models import User, Hotel, Room, Review, Booking, Payment, tag_amenities
+
+## Shared pieces of the performance suite (manage.py seed_data, bench_models, loadtest):
+## a deterministic data generator, latency summaries and baseline comparison, so results
+## saved with --json on one commit can be checked against the next with --baseline.
+
+LOCATIONS = ('Kathmandu', 'Pokhara', 'Chitwan', 'Lumbini', 'Nagarkot', 'Bandipur')
+## city centres; seeded hotels are spread up to SPREAD degrees around them
+COORDINATES = {
+    'Kathmandu': (27.7172, 85.3240), 'Pokhara': (28.2096, 83.9856), 'Chitwan': (27.5291, 84.3542),
+    'Lumbini': (27.4840, 83.2760), 'Nagarkot': (27.7154, 85.5204), 'Bandipur': (27.9380, 84.4070),
+}
+SPREAD = 0.05
+AMENITIES = ('wifi', 'pool', 'parking', 'breakfast', 'gym', 'spa', 'bar')
+SEED_PREFIX = 'bench-'
+
+
+@dataclass
+class Dataset:
+    owner: User
+    hotel_ids: list = field(default_factory=list)
+    room_ids: list = field(default_factory=list)
+    user_ids: list = field(default_factory=list)
+    booking_ids: list = field(default_factory=list)
+
+    def delete(self):
+        ## hotels, rooms, reviews, bookings and payments all cascade from the seeded users
+        User.objects.filter(pk__in=[self.owner.pk, *self.user_ids]).delete()
+
+
+def coordinates(rng, location):
+    ## bulk_create skips Hotel.save, so the grid cell is set here
+    latitude, longitude = (centre + rng.uniform(-SPREAD, SPREAD) for centre in COORDINATES[location])
+    return {'latitude': latitude, 'longitude': longitude, 'geo_cell': geo.cell(latitude, longitude)}
+
+
+def seed(hotels=50, rooms=20, users=100, bookings=500, reviews=500, seed=0, start=None):
+    """
+    Create a dataset through the models: bookings go through Booking.objects.reserve_many,
+    so they are priced and fill the inventory and analytics tables like real ones, and a third
+    of them get a payment. The same ``seed`` always produces the same data.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.date.today() + datetime.timedelta(days=1)
+    tag = f'{SEED_PREFIX}{time.time_ns()}'
+
+    owner = User.objects.create(username=f'{tag}-owner', role='MANAGER', first_name='Bench')
+    guests = User.objects.bulk_create([User(username=f'{tag}-{i}') for i in range(users)])
+    created_hotels = Hotel.objects.bulk_create([
+        Hotel(
+            name=f'Bench hotel {i}', description='Seeded for the performance suite',
+            location=location, owner=owner,
+            amenities=', '.join(rng.sample(AMENITIES, rng.randint(1, 4))),
+            **coordinates(rng, location),
+        )
+        for i, location in enumerate(rng.choice(LOCATIONS) for _ in range(hotels))
+    ])
+    created_rooms = Room.objects.bulk_create([
+        Room(
+            hotel=hotel, room_number=str(number), room_type=rng.choice(Room.ROOM_CHOICES)[0],
+            capacity=rng.randint(1, 4), price_per_night=rng.randrange(30, 300),
+            amenities=rng.choice(AMENITIES),
+        )
+        for hotel in created_hotels for number in range(rooms)
+    ], batch_size=1000)
+    dataset = Dataset(
+        owner=owner,
+        hotel_ids=[hotel.pk for hotel in created_hotels],
+        room_ids=[room.pk for room in created_rooms],
+        user_ids=[guest.pk for guest in guests],
+    )
+    ## bulk_create skips the amenity and search index signals
+    tag_amenities(created_hotels)
+    tag_amenities(created_rooms)
+    search.index_hotels(created_hotels)
+
+    if created_rooms and guests:
+        created_reviews = Review.objects.bulk_create([
+            Review(
+                hotel_id=room.hotel_id, room=room, user=rng.choice(guests),
+                comment='Seeded review', rating=rng.randint(1, 5),
+            )
+            for room in (rng.choice(created_rooms) for _ in range(reviews))
+        ], batch_size=1000)
+        ## and the review signals
+        search.index_reviews(created_reviews)
+        Hotel.rebuild_ratings(dataset.hotel_ids)
+        Room.rebuild_ratings(dataset.room_ids)
+
+        stays, taken = [], set()
+        for _ in range(bookings):
+            room = rng.choice(created_rooms)
+            check_in = start + datetime.timedelta(days=rng.randrange(180))
+            nights = rng.randint(1, 7)
+            wanted = {(room.pk, check_in + datetime.timedelta(days=n)) for n in range(nights)}
+            if wanted & taken:
+                continue
+            taken |= wanted
+            stays.append(dict(
+                room=room, checked_in_date=check_in,
+                checked_out_date=check_in + datetime.timedelta(days=nights), customer=rng.choice(guests),
+            ))
+        for batch in range(0, len(stays), 500):
+            created = Booking.objects.reserve_many(stays[batch:batch + 500])
+            dataset.booking_ids.extend(booking.pk for booking in created)
+            for booking in created[::3]:
+                Payment.objects.create(booking=booking, payment_choices='ESEWA')
+    return dataset
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in milliseconds) of one benchmark."""
+    ordered = sorted(latencies)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ordered[0] if ordered else 0.0
+    return {
+        'count': len(ordered),
+        'per_second': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+    }
+
+
+def format_summary(label, summary):
+    return (
+        f"{label:<24} {summary['per_second']:9.1f}/s   p50 {summary['p50_ms']:8.2f}ms   "
+        f"p95 {summary['p95_ms']:8.2f}ms   p99 {summary['p99_ms']:8.2f}ms   n={summary['count']}"
+    )
+
+
+def save_results(path, results):
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+
+
+def regressions(results, baseline_path, tolerance):
+    """
+    Benchmarks whose p95 grew, or whose throughput fell, by more than ``tolerance``
+    (0.2 = 20%) against the results saved at ``baseline_path``.
+    """
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    found = []
+    for label, summary in sorted(results.items()):
+        before = baseline.get(label)
+        if not before:
+            continue
+        if before['p95_ms'] and summary['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f"{label}: p95 {before['p95_ms']:.2f}ms -> {summary['p95_ms']:.2f}ms")
+        if before['per_second'] and summary['per_second'] < before['per_second'] * (1 - tolerance):
+            found.append(f"{label}: {before['per_second']:.1f}/s -> {summary['per_second']:.1f}/s")
+    return found
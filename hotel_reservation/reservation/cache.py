@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+## Public catalogue responses (hotels, hotel detail, rooms of a hotel) are cached per scope.
+## Each scope has a version stamp: the time it last changed. Saves/deletes bump the stamp
+## (see signals.py), which orphans every cached response of that scope without having to
+## find and delete keys, so it works on any cache backend. The stamp doubles as Last-Modified.
+## Writers bump it again when their transaction commits: a reader that cached the old rows
+## under the first bump, before the commit, would otherwise serve them until the timeout.
+
+HOTELS = 'hotels'
+
+
+def hotel_scope(hotel_id):
+    return f'hotel:{hotel_id}'
+
+
+def pricing_scope(hotel_id):
+    ## rate plans, stay discounts and surges of a hotel; see pricing.py
+    return f'pricing:{hotel_id}'
+
+
+def catalogue_cache():
+    return caches[getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(scope):
+    return f'catalogue:version:{scope}'
+
+
+def touch(*scopes):
+    now = time.time_ns()
+    catalogue_cache().set_many({_version_key(scope): now for scope in scopes}, timeout=None)
+
+
+def touch_on_commit(*scopes):
+    ## now, so the writer's own transaction reads the change, and again once it is visible to others
+    touch(*scopes)
+    transaction.on_commit(lambda: touch(*scopes))
+
+
+def versions(*scopes):
+    cache = catalogue_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            ## unknown scope, e.g. after a cache flush: start a fresh version
+            now = time.time_ns()
+            cache.add(key, now, timeout=None)
+            ## a dummy backend or an immediate eviction stores nothing
+            found[key] = cache.get(key) or now
+    return [found[key] for key in keys]
+
+
+class CatalogueCacheMixin:
+    """
+    Serve anonymous list/retrieve requests from the catalogue cache with ETag and
+    Last-Modified validators. Views declare which scopes a response depends on.
+    """
+
+    def get_cache_scopes(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, render, *args, **kwargs):
+        if request.user and request.user.is_authenticated:
+            return render(request, *args, **kwargs)
+
+        stamps = versions(*self.get_cache_scopes())
+        query = '&'.join(sorted(request.GET.urlencode().split('&')))
+        ## host is part of the key because paginated responses carry absolute next/previous links
+        key = hashlib.md5(f'{request.get_host()}{request.path}?{query}|{stamps}'.encode()).hexdigest()
+        cache = catalogue_cache()
+        entry = cache.get(f'catalogue:response:{key}')
+
+        if entry is None:
+            response = render(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = json.dumps(response.data, cls=JSONEncoder, sort_keys=True).encode()
+            entry = {
+                'data': response.data,
+                'etag': quote_etag(hashlib.md5(body).hexdigest()),
+                'last_modified': max(stamps) // 1_000_000_000,
+            }
+            cache.set(f'catalogue:response:{key}', entry, getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+
+        not_modified = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+        if not_modified is not None:
+            return not_modified
+
+        response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        return response
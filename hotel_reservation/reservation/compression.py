@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+## Response compression, negotiated from Accept-Encoding.
+##
+## Brotli is used when the client prefers it (or weighs it equally with gzip) and the brotli
+## package is installed; otherwise Django's GZipMiddleware takes over, including for streamed
+## responses such as exports. Unlike GZipMiddleware's pattern match, q-values are honoured, so
+## "gzip;q=0" turns gzip off. Short responses, and those that would not shrink, go out as they are.
+##
+## Under ASGI process_response runs on the event loop rather than being handed to a thread as
+## MiddlewareMixin would: it only compresses bytes it already holds (or wraps a streamed body).
+
+MIN_LENGTH = 200
+
+
+def accepted_encodings(header):
+    ## {coding: q} of an Accept-Encoding header
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+class CompressionMiddleware(GZipMiddleware):
+
+    async def __acall__(self, request):
+        ## GZipMiddleware has no process_request
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if (not response.streaming and len(response.content) < MIN_LENGTH) or response.has_header('Content-Encoding'):
+            return response
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        anything = accepted.get('*', 0.0)
+        brotli_q, gzip_q = accepted.get('br', anything), accepted.get('gzip', anything)
+
+        if brotli is None or response.streaming or brotli_q <= 0 or brotli_q < gzip_q:
+            if gzip_q <= 0:
+                patch_vary_headers(response, ('Accept-Encoding',))
+                return response
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=getattr(settings, 'BROTLI_QUALITY', 5))
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        ## as GZipMiddleware does: the compressed body is not byte-for-byte the tagged one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,105 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+## Read/write splitting. ReplicaReadsMiddleware flags GET/HEAD/OPTIONS requests as read-only and
+## PrimaryReplicaRouter sends reads made while serving them to a replica. Everything else (writes,
+## reads inside POST/PUT/PATCH/DELETE such as the booking overlap check, and reads inside a
+## transaction on the primary, which must see its own uncommitted rows) stays on the primary.
+## The flag also covers streamed responses (exports), whose queries run as the body is sent.
+
+_read_only_request = ContextVar('read_only_request', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if replicas and _read_only_request.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        ## replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def pinned(response, var, value):
+    """
+    Run the rest of a streamed response's body with ``var`` set to ``value``. The body is
+    generated after the middleware has returned, so each chunk sets and resets it itself.
+    """
+    if not response.streaming:
+        return response
+    content = response.streaming_content
+    if response.is_async:
+        async def stream():
+            iterator = aiter(content)
+            while True:
+                token = var.set(value)
+                try:
+                    chunk = await anext(iterator)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    var.reset(token)
+                yield chunk
+    else:
+        def stream():
+            iterator = iter(content)
+            while True:
+                token = var.set(value)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    var.reset(token)
+                yield chunk
+    response.streaming_content = stream()
+    return response
+
+
+class ReplicaReadsMiddleware:
+    ## runs in the mode of the handler, so async views under ASGI are not pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        read_only = request.method in SAFE_METHODS
+        token = _read_only_request.set(read_only)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_only_request.reset(token)
+        return pinned(response, _read_only_request, read_only)
+
+    async def __acall__(self, request):
+        read_only = request.method in SAFE_METHODS
+        token = _read_only_request.set(read_only)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_only_request.reset(token)
+        return pinned(response, _read_only_request, read_only)
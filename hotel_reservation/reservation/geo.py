@@ -0,0 +1,114 @@
+import math
+
+from django.db.models import Q
+from django.db.models.functions import Mod
+from django.db.models.lookups import Range
+
+## Proximity search without PostGIS.
+##
+## Hotel.geo_cell numbers the CELL_DEGREES x CELL_DEGREES square of the latitude/longitude grid
+## the hotel lies in, row by row from the south-west corner, and is indexed. A row of neighbouring
+## cells is one range of cell numbers, so any block of cells is one index range per row.
+## nearest() reads blocks of growing size around the point until no unread cell can hold a hotel
+## closer than the `limit` found so far: a map over a dense city reads a few cells, not the table.
+## Past MAX_RANGES rows a block is read as the one range of cell numbers from its first row to
+## its last, kept to its columns: one OR-ed range per row would make too big a query.
+
+CELL_DEGREES = 0.01
+ROWS = round(180 / CELL_DEGREES)
+COLUMNS = round(360 / CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_RADIUS_KM = 200
+MAX_RANGES = 32
+
+
+def _row(latitude):
+    return min(max(int((latitude + 90) // CELL_DEGREES), 0), ROWS - 1)
+
+
+def _column(longitude):
+    return min(max(int((longitude + 180) // CELL_DEGREES), 0), COLUMNS - 1)
+
+
+def cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * COLUMNS + _column(longitude)
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    ## haversine
+    lat1, lat2 = math.radians(latitude), math.radians(other_latitude)
+    half_lat = (lat2 - lat1) / 2
+    half_lng = math.radians(other_longitude - longitude) / 2
+    a = math.sin(half_lat) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(half_lng) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(latitude, longitude, radius_km):
+    ## (south, west, north, east) around a circle, clamped at the poles and the antimeridian
+    degrees = radius_km / KM_PER_DEGREE
+    stretch = math.cos(math.radians(min(abs(latitude) + degrees, 89.9)))
+    return (
+        max(latitude - degrees, -90.0), max(longitude - degrees / stretch, -180.0),
+        min(latitude + degrees, 90.0), min(longitude + degrees / stretch, 180.0),
+    )
+
+
+def nearest(hotels, latitude, longitude, limit, radius_km=None, box=None):
+    """
+    [(hotel id, km)] of the ``limit`` hotels of the ``hotels`` queryset closest to the point,
+    closest first, optionally only those within ``radius_km`` and/or the (south, west, north,
+    east) ``box``.
+    """
+    south, west, north, east = box or (-90.0, -180.0, 90.0, 180.0)
+    if radius_km is not None:
+        around = radius_box(latitude, longitude, radius_km)
+        south, west = max(south, around[0]), max(west, around[1])
+        north, east = min(north, around[2]), min(east, around[3])
+    if south > north or west > east:
+        return []
+    if box or radius_km is not None:
+        hotels = hotels.filter(latitude__range=(south, north), longitude__range=(west, east))
+    first_row, last_row, first_column, last_column = _row(south), _row(north), _column(west), _column(east)
+    row, column = _row(latitude), _column(longitude)
+
+    found = {}
+    read, size = -1, 0
+    while True:
+        ## the ring of cells between the block read so far (half-width `read`) and the next one
+        condition = Q()
+        rows = range(max(row - size, first_row), min(row + size, last_row) + 1)
+        if len(rows) > MAX_RANGES:
+            ## the whole block, the part read already included
+            start, end = max(column - size, first_column), min(column + size, last_column)
+            condition = Q(Range(Mod('geo_cell', COLUMNS), (start, end)),
+                          geo_cell__range=(rows[0] * COLUMNS + start, rows[-1] * COLUMNS + end))
+            rows = ()
+        for ring_row in rows:
+            if abs(ring_row - row) > read:
+                spans = [(column - size, column + size)]
+            else:
+                spans = [(column - size, column - read - 1), (column + read + 1, column + size)]
+            for start, end in spans:
+                start, end = max(start, first_column), min(end, last_column)
+                if start <= end:
+                    ## a run of cells in one row is one range of the index
+                    condition |= Q(geo_cell__range=(ring_row * COLUMNS + start, ring_row * COLUMNS + end))
+        if condition:
+            for pk, hotel_latitude, hotel_longitude in hotels.filter(condition).values_list('pk', 'latitude', 'longitude'):
+                distance = distance_km(latitude, longitude, hotel_latitude, hotel_longitude)
+                if radius_km is None or distance <= radius_km:
+                    found[pk] = distance
+
+        ## a hotel outside the block is at least `size` cells away, cells being narrowest nearest the pole
+        pole = min(max(abs(latitude - (size + 1) * CELL_DEGREES), abs(latitude + (size + 1) * CELL_DEGREES)), 89.9)
+        reach = size * CELL_DEGREES * KM_PER_DEGREE * math.cos(math.radians(pole))
+        covered = (row - size <= first_row and row + size >= last_row
+                   and column - size <= first_column and column + size >= last_column)
+        if covered or sum(distance <= reach for distance in found.values()) >= limit:
+            break
+        read, size = size, max(1, size * 2)
+
+    return sorted(found.items(), key=lambda item: (item[1], item[0]))[:limit]
@@ -0,0 +1,95 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import FilteredRelation, Q
+
+from .analytics import hotel_ids_for
+from .models import Booking, RoomNight
+
+## Per-night room inventory. Every night of an active (pending or completed) booking holds a
+## RoomNight row; cancelling or deleting the booking releases them. Signals keep the table in
+## step with bookings (see signals.py); `manage.py rebuild_room_nights` repairs it from scratch.
+
+ONE_DAY = datetime.timedelta(days=1)
+MAX_CALENDAR_DAYS = 366
+
+
+def _nights(booking, hotel_id):
+    day = booking.checked_in_date
+    while day < booking.checked_out_date:
+        yield RoomNight(room_id=booking.room_id, hotel_id=hotel_id, booking_id=booking.pk, date=day)
+        day += ONE_DAY
+
+
+def hold(bookings, ignore_conflicts=False):
+    ## an overlapping night raises IntegrityError unless ignore_conflicts is set
+    bookings = [booking for booking in bookings if booking.stay_key() is not None]
+    hotel_ids = hotel_ids_for({booking.room_id for booking in bookings}, bookings)
+    RoomNight.objects.bulk_create(
+        [night for booking in bookings for night in _nights(booking, hotel_ids[booking.room_id])],
+        ignore_conflicts=ignore_conflicts,
+    )
+
+
+def booking_changed(booking, previous):
+    ## previous is the booking's stay_key() as loaded (None for a new or inactive booking)
+    if previous == booking.stay_key():
+        return
+    with transaction.atomic():
+        if previous is not None:
+            RoomNight.objects.filter(booking=booking).delete()
+        hold([booking])
+
+
+def release(booking_ids):
+    ## for bookings cancelled by a bulk UPDATE, which sends no post_save
+    RoomNight.objects.filter(booking_id__in=booking_ids).delete()
+
+
+def calendar(hotel, start, days):
+    """
+    Availability matrix for ``days`` nights from ``start``: one string per room with
+    '1' for a booked night and '0' for a free one.
+    """
+    end = start + ONE_DAY * days
+    ## one query: every room, joined to the nights it holds in the range (none for a free room)
+    rows = hotel.rooms.order_by('room_number', 'pk').annotate(
+        held=FilteredRelation('nights', condition=Q(nights__date__gte=start, nights__date__lt=end)),
+    ).values_list('pk', 'room_number', 'held__date')
+    rooms = {}
+    for room_id, room_number, date in rows:
+        booked = rooms.setdefault(room_id, (room_number, set()))[1]
+        if date is not None:
+            booked.add((date - start).days)
+    return [
+        {
+            'room': room_id,
+            'room_number': room_number,
+            'nights': ''.join('1' if offset in booked else '0' for offset in range(days)),
+        }
+        for room_id, (room_number, booked) in rooms.items()
+    ]
+
+
+def rebuild(hotel_ids=None, batch_size=1000):
+    """Recreate the inventory from active bookings, for every hotel or only ``hotel_ids``."""
+    nights = RoomNight.objects.all()
+    bookings = Booking.objects.filter(status__in=Booking.ACTIVE_STATUSES).select_related('room').only(
+        'id', 'room_id', 'room__hotel_id', 'status', 'checked_in_date', 'checked_out_date', 'nights', 'total_amount',
+    ).order_by()
+    if hotel_ids is not None:
+        nights = nights.filter(hotel_id__in=hotel_ids)
+        bookings = bookings.filter(room__hotel_id__in=hotel_ids)
+
+    with transaction.atomic():
+        nights.delete()
+        batch, count = [], 0
+        for booking in bookings.iterator(chunk_size=batch_size):
+            batch.append(booking)
+            if len(batch) == batch_size:
+                ## bookings that overlapped before the inventory existed keep the first night's holder
+                hold(batch, ignore_conflicts=True)
+                count += len(batch)
+                batch = []
+        hold(batch, ignore_conflicts=True)
+    return count + len(batch)
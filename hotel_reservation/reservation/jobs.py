@@ -0,0 +1,103 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+## Background jobs, queued as Job rows and run by `manage.py run_jobs` workers.
+##
+## Functions register with @job(name, every=...). enqueue() queues a one-off run; recurring jobs
+## are queued by schedule() when a worker starts and queue their own next run when they finish,
+## so each has exactly one pending row. Workers claim due rows with SKIP LOCKED where supported,
+## so several can share the queue, and a claimed job holds a lease: if its worker dies, the job
+## is claimed again once the lease runs out. Jobs must therefore be safe to run twice. A job
+## that raises is retried with a doubling delay up to JOB_MAX_ATTEMPTS times.
+
+REGISTRY = {}
+
+
+def job(name, every=None):
+    def register(function):
+        REGISTRY[name] = (function, every)
+        return function
+    return register
+
+
+def enqueue(name, run_at=None, **payload):
+    if name not in REGISTRY:
+        raise KeyError(f"No job named {name!r}")
+    return Job.objects.create(name=name, payload=payload, run_at=run_at or timezone.now())
+
+
+def schedule():
+    """Queue every recurring job that has no pending run, to run now."""
+    pending = set(Job.objects.filter(status__in=['QUEUED', 'RUNNING']).values_list('name', flat=True).distinct())
+    return [enqueue(name) for name, (_, every) in REGISTRY.items() if every and name not in pending]
+
+
+def _lease():
+    return datetime.timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 600))
+
+
+def claim():
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = (
+            Job.objects.filter(Q(status='QUEUED', run_at__lte=now) | Q(status='RUNNING', locked_until__lt=now))
+            .order_by('run_at', 'id')
+            .select_for_update(skip_locked=True)
+            .first()
+        )
+        if claimed is not None:
+            claimed.status = 'RUNNING'
+            claimed.locked_until = now + _lease()
+            claimed.attempts += 1
+            claimed.save(update_fields=['status', 'locked_until', 'attempts'])
+    return claimed
+
+
+def run(claimed):
+    function, every = REGISTRY.get(claimed.name, (None, None))
+    now = timezone.now()
+    try:
+        if function is None:
+            raise KeyError(f"No job named {claimed.name!r}")
+        claimed.result = function(**claimed.payload)
+        claimed.status = 'DONE'
+    except Exception:
+        logger.exception("Job %s (%s) failed", claimed.pk, claimed.name)
+        claimed.last_error = traceback.format_exc()
+        if claimed.attempts < getattr(settings, 'JOB_MAX_ATTEMPTS', 3) and function is not None:
+            claimed.status = 'QUEUED'
+            claimed.run_at = now + datetime.timedelta(seconds=30 * 2 ** (claimed.attempts - 1))
+        else:
+            claimed.status = 'FAILED'
+    claimed.locked_until = None
+    if claimed.status != 'QUEUED':
+        claimed.finished_at = timezone.now()
+    with transaction.atomic():
+        claimed.save(update_fields=['status', 'result', 'last_error', 'run_at', 'locked_until', 'finished_at'])
+        if every and claimed.status != 'QUEUED':
+            ## on the beat of the previous run, unless the worker has fallen behind
+            enqueue(claimed.name, run_at=max(claimed.run_at + every, now), **claimed.payload)
+    return claimed
+
+
+def run_due(limit=10):
+    """Run the jobs that are due, at most ``limit`` of them, and return how many ran."""
+    ran = 0
+    while ran < limit:
+        ## one at a time, so a long job does not sit on the leases of those behind it
+        claimed = claim()
+        if claimed is None:
+            break
+        run(claimed)
+        ran += 1
+    return ran
@@ -0,0 +1,98 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import analytics, inventory
+from .jobs import job
+from .models import Booking, Payment
+
+## Booking lifecycle transitions, run as recurring jobs (see jobs.py):
+##
+##   expire_pending_bookings  PENDING -> CANCELLED when no payment has completed within
+##                            BOOKING_PAYMENT_TIMEOUT minutes of booking; the nights are released
+##                            and a pending payment is marked FAILED. Cash is paid at the hotel,
+##                            so cash bookings never expire.
+##   complete_stays           PENDING -> COMPLETED once a paid (or cash) stay has checked out.
+##                            Both statuses hold the room, so inventory and rollups are unchanged:
+##                            past nights stay sold.
+##   flag_refunds_due         COMPLETED payments of cancelled bookings -> REFUND_DUE, e.g. a gateway
+##                            callback that arrived after the booking expired. No money moves here:
+##                            the refund is made with the gateway and the payment then marked
+##                            REFUNDED by staff. The paid revenue comes off the rollups now.
+##
+## The sweeps walk the partial pending-booking indexes in keyset chunks and change each chunk
+## with a few bulk UPDATEs, so a pass over millions of bookings is a few queries per CHUNK_SIZE
+## rows. Bulk updates send no signals; the sweeps keep inventory and analytics in step themselves.
+
+CHUNK_SIZE = 5000
+
+
+def _settled():
+    ## paid, or paid in cash at the hotel
+    return Exists(Payment.objects.filter(Q(status='COMPLETED') | Q(payment_choices='CASH'), booking=OuterRef('pk')))
+
+
+def _chunks(candidates, order, chunk_size):
+    ## ids of ``candidates`` in (order, id) order, resuming after the last row of each chunk
+    last = None
+    while True:
+        page = candidates
+        if last is not None:
+            ## a range on the index, rather than an OR the planner cannot seek on
+            page = page.filter(**{f'{order}__gte': last[0]}).exclude(**{order: last[0], 'id__lte': last[1]})
+        rows = list(page.order_by(order, 'id').values_list(order, 'id')[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1]
+        yield [pk for _, pk in rows]
+
+
+@job('expire_pending_bookings', every=datetime.timedelta(minutes=5))
+def expire_pending_bookings(chunk_size=CHUNK_SIZE):
+    cutoff = timezone.now() - datetime.timedelta(minutes=getattr(settings, 'BOOKING_PAYMENT_TIMEOUT', 30))
+    expired = Booking.objects.filter(~_settled(), status='PENDING', created_at__lt=cutoff)
+    cancelled = 0
+    for ids in _chunks(expired, 'created_at', chunk_size):
+        with transaction.atomic():
+            ## re-checked under the lock: a payment may have completed since the chunk was read
+            stays = list(
+                expired.filter(pk__in=ids).select_for_update(skip_locked=True)
+                .values_list('pk', 'room_id', 'checked_in_date', 'checked_out_date', 'nights', 'total_amount')
+            )
+            if not stays:
+                continue
+            pks = [pk for pk, *_ in stays]
+            Booking.objects.filter(pk__in=pks).update(status='CANCELLED')
+            Payment.objects.filter(booking_id__in=pks, status='PENDING').update(status='FAILED')
+            inventory.release(pks)
+            analytics.record_stays_removed([tuple(key) for _, *key in stays])
+        cancelled += len(stays)
+    return {'cancelled': cancelled}
+
+
+@job('complete_stays', every=datetime.timedelta(hours=1))
+def complete_stays(chunk_size=CHUNK_SIZE):
+    finished = Booking.objects.filter(_settled(), status='PENDING', checked_out_date__lte=timezone.localdate())
+    completed = 0
+    for ids in _chunks(finished, 'checked_out_date', chunk_size):
+        completed += Booking.objects.filter(pk__in=ids, status='PENDING').update(status='COMPLETED')
+    return {'completed': completed}
+
+
+@job('flag_refunds_due', every=datetime.timedelta(hours=1))
+def flag_refunds_due(chunk_size=CHUNK_SIZE):
+    ## rare, and found by a scan of the payments: nothing indexes a payment by its booking's status
+    owed = Payment.objects.filter(status='COMPLETED', booking__status='CANCELLED')
+    flagged = 0
+    while True:
+        with transaction.atomic():
+            payments = list(owed.select_for_update(skip_locked=True, of=('self',)).values_list('pk', 'booking_id', 'amount')[:chunk_size])
+            if not payments:
+                break
+            Payment.objects.filter(pk__in=[pk for pk, _, _ in payments]).update(status='REFUND_DUE')
+            analytics.record_payments([(booking_id, amount, -1) for _, booking_id, amount in payments])
+        flagged += len(payments)
+    return {'refund_due': flagged}
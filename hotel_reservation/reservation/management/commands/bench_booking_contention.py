@@ -0,0 +1,67 @@
+import datetime
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from reservation.models import User, Hotel, Room, Booking, RoomAlreadyBooked
+
+
+class Command(BaseCommand):
+    help = "Hammer a single room with concurrent reservations and verify that no two active bookings overlap."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--attempts', type=int, default=50, help='reservations attempted per thread')
+        parser.add_argument('--days', type=int, default=120, help='width of the calendar the stays are drawn from')
+        parser.add_argument('--keep', action='store_true', help='keep the benchmark hotel instead of deleting it')
+
+    def handle(self, *args, **options):
+        owner = User.objects.create(username=f'bench-{time.time_ns()}', role='MANAGER')
+        hotel = Hotel.objects.create(name='Contention bench', description='', location='bench', owner=owner, amenities='')
+        room = Room.objects.create(hotel=hotel, room_number='1', price_per_night=100)
+        start = datetime.date.today()
+        counts = {'booked': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(options['attempts']):
+                    check_in = start + datetime.timedelta(days=rng.randrange(options['days']))
+                    check_out = check_in + datetime.timedelta(days=rng.randint(1, 5))
+                    try:
+                        Booking.objects.reserve(room=room, checked_in_date=check_in, checked_out_date=check_out, customer=owner)
+                        outcome = 'booked'
+                    except RoomAlreadyBooked:
+                        outcome = 'rejected'
+                    except Exception:
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        stays = sorted(room.bookings.values_list('checked_in_date', 'checked_out_date'))
+        overlaps = sum(1 for previous, current in zip(stays, stays[1:]) if current[0] < previous[1])
+        attempts = sum(counts.values())
+
+        self.stdout.write(f"threads={options['threads']} attempts={attempts} elapsed={elapsed:.2f}s")
+        self.stdout.write(f"booked={counts['booked']} rejected={counts['rejected']} errors={counts['errors']}")
+        self.stdout.write(f"bookings/sec={counts['booked'] / elapsed:.1f} attempts/sec={attempts / elapsed:.1f}")
+        self.stdout.write(f"overlapping stays={overlaps}")
+
+        if not options['keep']:
+            owner.delete()
+        if overlaps:
+            raise CommandError(f"{overlaps} overlapping bookings were created")
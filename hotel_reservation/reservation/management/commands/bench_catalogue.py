@@ -0,0 +1,130 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from reservation.models import User, Hotel, Room, Review
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync DRF catalogue endpoints (WSGI handler) with the async ones (ASGI handler) "
+        "on the same seeded dataset and report requests/sec and latency percentiles. By default both "
+        "run in this process through the test clients, which share one interpreter and database "
+        "connection and so mostly compare the code paths; pass --wsgi-url and --asgi-url to load "
+        "real servers (e.g. gunicorn and uvicorn) started against the same database instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, default=200)
+        parser.add_argument('--rooms', type=int, default=30, help='rooms (and reviews) per hotel')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--with-cache', action='store_true', help='let the sync endpoints use the catalogue cache')
+        parser.add_argument('--wsgi-url', help='base URL of a WSGI server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--asgi-url', help='base URL of an ASGI server, e.g. http://127.0.0.1:8001')
+
+    def handle(self, *args, **options):
+        if bool(options['wsgi_url']) != bool(options['asgi_url']):
+            raise CommandError("--wsgi-url and --asgi-url go together")
+        owner = self.seed(options['hotels'], options['rooms'])
+        try:
+            hotel_ids = list(owner.hotels.values_list('pk', flat=True))
+            paths = [
+                ('hotels', '/hotels/', '/async/hotels/'),
+                ('rooms', '/hotels/{}/rooms/', '/async/hotels/{}/rooms/'),
+                ('reviews', '/hotels/{}/reviews/', '/async/hotels/{}/reviews/'),
+            ]
+            bench_settings = {'ALLOWED_HOSTS': ['testserver']}
+            if not options['with_cache']:
+                bench_settings['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            with override_settings(**bench_settings):
+                for name, sync_path, async_path in paths:
+                    urls = [
+                        (sync_path.format(hotel_ids[i % len(hotel_ids)]), async_path.format(hotel_ids[i % len(hotel_ids)]))
+                        for i in range(options['requests'])
+                    ]
+                    if options['wsgi_url']:
+                        self.report(f'{name} wsgi server', self.run_http(options['wsgi_url'], [u for u, _ in urls], options['concurrency']))
+                        self.report(f'{name} asgi server', self.run_http(options['asgi_url'], [u for _, u in urls], options['concurrency']))
+                        continue
+                    self.report(f'{name} sync/wsgi', self.run_sync([u for u, _ in urls], options['concurrency']))
+                    self.report(f'{name} async/asgi', asyncio.run(self.run_async([u for _, u in urls], options['concurrency'])))
+        finally:
+            owner.delete()
+
+    def seed(self, hotels, rooms):
+        owner = User.objects.create(username=f'bench-{time.time_ns()}', role='MANAGER', first_name='Bench')
+        created = Hotel.objects.bulk_create([
+            Hotel(name=f'Bench hotel {i}', description='Seeded for bench_catalogue', location='Bench', owner=owner, amenities='wifi')
+            for i in range(hotels)
+        ])
+        Room.objects.bulk_create([
+            Room(hotel=hotel, room_number=str(number), price_per_night=50 + number)
+            for hotel in created for number in range(rooms)
+        ], batch_size=1000)
+        Review.objects.bulk_create([
+            Review(hotel=hotel, user=owner, comment='Seeded review', rating=1 + number % 5)
+            for hotel in created for number in range(rooms)
+        ], batch_size=1000)
+        ## bulk_create skips the review signals
+        Hotel.rebuild_ratings([hotel.pk for hotel in created])
+        return owner
+
+    def run_sync(self, urls, concurrency):
+        def fetch(url):
+            client = Client()
+            began = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - began
+            close_old_connections()
+            assert response.status_code == 200, (url, response.status_code)
+            return elapsed
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(fetch, urls))
+        return latencies, time.perf_counter() - began
+
+    async def run_async(self, urls, concurrency):
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def fetch(url):
+            async with gate:
+                began = time.perf_counter()
+                response = await client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+                return time.perf_counter() - began
+
+        began = time.perf_counter()
+        latencies = await asyncio.gather(*(fetch(url) for url in urls))
+        return latencies, time.perf_counter() - began
+
+    def run_http(self, base_url, urls, concurrency):
+        ## the servers do the work here; the client threads only wait on sockets
+        def fetch(url):
+            began = time.perf_counter()
+            with urlopen(base_url.rstrip('/') + url) as response:
+                response.read()
+                assert response.status == 200, (url, response.status)
+            return time.perf_counter() - began
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(fetch, urls))
+        return latencies, time.perf_counter() - began
+
+    def report(self, label, result):
+        latencies, elapsed = result
+        cuts = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{label:<20} {len(latencies) / elapsed:8.1f} req/s   "
+            f"p50 {cuts[49] * 1000:7.2f}ms   p95 {cuts[94] * 1000:7.2f}ms   p99 {cuts[98] * 1000:7.2f}ms"
+        )
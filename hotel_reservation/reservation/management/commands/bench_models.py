@@ -0,0 +1,89 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from reservation import benchmarks, pricing
+from reservation.models import Hotel, Room, Booking, User
+from reservation.serializers import HotelSerializers, RoomSerializer, BookingSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmarks for the serializers, Booking.save and the pricing engine on a seeded dataset "
+        "that is rolled back afterwards. Save results with --json and compare later runs with --baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--hotels', type=int, default=20)
+        parser.add_argument('--rooms', type=int, default=20, help='rooms per hotel')
+        parser.add_argument('--json', help='write the results to this file')
+        parser.add_argument('--baseline', help='fail if results regress against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            dataset = benchmarks.seed(hotels=options['hotels'], rooms=options['rooms'], users=20, bookings=200, reviews=200)
+            results = {
+                label: self.measure(bench, options['iterations'], options['warmup'])
+                for label, bench in self.benchmarks(dataset).items()
+            }
+            transaction.set_rollback(True)
+
+        for label, summary in results.items():
+            self.stdout.write(benchmarks.format_summary(label, summary))
+        if options['json']:
+            benchmarks.save_results(options['json'], results)
+        if options['baseline']:
+            found = benchmarks.regressions(results, options['baseline'], options['tolerance'])
+            if found:
+                raise CommandError("Regressions:\n" + "\n".join(found))
+
+    def benchmarks(self, dataset):
+        hotels = list(Hotel.objects.filter(pk__in=dataset.hotel_ids).select_related('owner').annotate(room_count=Count('rooms'))[:20])
+        rooms = list(Room.objects.filter(pk__in=dataset.room_ids)[:20])
+        customer = User.objects.get(pk=dataset.user_ids[0])
+        quote_rooms = list(Room.objects.filter(pk__in=dataset.room_ids).only('id', 'hotel_id', 'room_type', 'price_per_night')[:200])
+        ## far beyond the seeded bookings, so new stays never clash
+        far = datetime.date.today() + datetime.timedelta(days=1000)
+        slots = iter(range(10 ** 6))
+        payload = {'room': rooms[0].pk, 'checked_in_date': far.isoformat(), 'checked_out_date': (far + datetime.timedelta(days=3)).isoformat()}
+
+        def book():
+            slot = next(slots)
+            check_in = far + datetime.timedelta(days=3 * (slot // len(rooms)))
+            booking = Booking(room=rooms[slot % len(rooms)], customer=customer, checked_in_date=check_in,
+                              checked_out_date=check_in + datetime.timedelta(days=2))
+            booking.save()
+            return booking
+
+        def cancel():
+            booking = book()
+            booking.status = 'CANCELLED'
+            began = time.perf_counter()
+            booking.save(update_fields=['status'])
+            return time.perf_counter() - began
+
+        return {
+            'HotelSerializers x20': lambda: HotelSerializers(hotels, many=True).data,
+            'RoomSerializer x20': lambda: RoomSerializer(rooms, many=True).data,
+            'BookingSerializer valid': lambda: BookingSerializer(data=payload, context={'rooms': {rooms[0].pk: rooms[0]}}).is_valid(raise_exception=True),
+            'Booking.save create': book,
+            'Booking.save cancel': cancel,
+            'quote 200 rooms x 14n': lambda: pricing.quote([(room, far, far + datetime.timedelta(days=14)) for room in quote_rooms]),
+        }
+
+    def measure(self, bench, iterations, warmup):
+        for _ in range(warmup):
+            bench()
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            result = bench()
+            ## a benchmark that times only part of its work returns that time itself
+            latencies.append(result if isinstance(result, float) else time.perf_counter() - started)
+        return benchmarks.summarize(latencies, sum(latencies))
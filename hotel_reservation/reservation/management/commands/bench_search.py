@@ -0,0 +1,111 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from reservation import benchmarks, search
+from reservation.benchmarks import AMENITIES, LOCATIONS
+from reservation.models import Hotel, Review, User
+
+WORDS = (
+    'clean', 'room', 'staff', 'friendly', 'breakfast', 'view', 'mountain', 'lake', 'quiet', 'noisy',
+    'comfortable', 'bed', 'shower', 'location', 'helpful', 'price', 'value', 'food', 'restaurant', 'walk',
+    'spacious', 'small', 'dirty', 'excellent', 'terrible', 'stay', 'again', 'recommend', 'family', 'trek',
+    'garden', 'balcony', 'sunrise', 'service', 'wifi', 'slow', 'fast', 'hot', 'water', 'cold',
+)
+SYLLABLES = ('ka', 'ma', 'na', 'po', 'khar', 'dhu', 'li', 'ban', 'di', 'pur', 'go', 'ra', 'she', 'tan', 'ti')
+
+
+class Command(BaseCommand):
+    help = (
+        "Query latency of the full-text search index over a generated catalogue that is rolled back "
+        "afterwards, e.g. --hotels 100000 --reviews 5000000 for the production-sized run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, default=10_000)
+        parser.add_argument('--reviews', type=int, default=200_000)
+        parser.add_argument('--iterations', type=int, default=200, help='queries per kind')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='write the results to this file')
+        parser.add_argument('--baseline', help='fail if results regress against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ## a long tail of made-up place and hotel words, so the vocabulary is not only the fixed lists
+        towns = sorted({''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(2000)})
+        vocabulary = WORDS + tuple(towns)
+        ## roughly Zipf: the common review words far more often than the rare ones
+        weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+        with transaction.atomic():
+            began = time.perf_counter()
+            hotel_ids = self.seed(rng, towns, vocabulary, weights, options['hotels'], options['reviews'])
+            self.stdout.write(f"seeded {options['hotels']} hotels and {options['reviews']} reviews in {time.perf_counter() - began:.1f}s")
+            began = time.perf_counter()
+            search.rebuild()
+            self.stdout.write(f"indexed in {time.perf_counter() - began:.1f}s")
+
+            queries = {
+                'one word': lambda: search.search_hotels(rng.choice(LOCATIONS)),
+                'two words': lambda: search.search_hotels(f'{rng.choice(LOCATIONS)} {rng.choice(AMENITIES)}'),
+                'prefix': lambda: search.search_hotels(rng.choice(towns)[:rng.randint(2, 4)]),
+                'typo': lambda: search.search_hotels(self.misspell(rng, rng.choice(LOCATIONS))),
+                'reviews': lambda: search.search_reviews(' '.join(rng.sample(WORDS, 2))),
+                'hotel reviews': lambda: search.search_reviews(rng.choice(WORDS), hotel_id=rng.choice(hotel_ids)),
+            }
+            results = {}
+            for label, query in queries.items():
+                latencies = []
+                for _ in range(options['iterations']):
+                    began = time.perf_counter()
+                    query()
+                    latencies.append(time.perf_counter() - began)
+                results[label] = benchmarks.summarize(latencies, sum(latencies))
+            transaction.set_rollback(True)
+
+        for label, summary in results.items():
+            self.stdout.write(benchmarks.format_summary(label, summary))
+        if options['json']:
+            benchmarks.save_results(options['json'], results)
+        if options['baseline']:
+            found = benchmarks.regressions(results, options['baseline'], options['tolerance'])
+            if found:
+                raise CommandError("Regressions:\n" + "\n".join(found))
+
+    def seed(self, rng, towns, vocabulary, weights, hotels, reviews):
+        owner = User.objects.create(username=f'{benchmarks.SEED_PREFIX}{time.time_ns()}-search', role='MANAGER')
+        hotel_ids = []
+        for start in range(0, hotels, 10_000):
+            created = Hotel.objects.bulk_create([
+                Hotel(
+                    name=f'{rng.choice(towns).title()} {rng.choice(("Inn", "Lodge", "Resort", "Guest House"))}',
+                    description=' '.join(rng.choices(vocabulary, cum_weights=weights, k=20)),
+                    location=rng.choice(LOCATIONS), owner=owner,
+                    amenities=', '.join(rng.sample(AMENITIES, rng.randint(1, 4))),
+                )
+                for _ in range(min(10_000, hotels - start))
+            ])
+            hotel_ids.extend(hotel.pk for hotel in created)
+        for start in range(0, reviews, 10_000):
+            Review.objects.bulk_create([
+                Review(
+                    hotel_id=rng.choice(hotel_ids), user=owner, rating=rng.randint(1, 5),
+                    comment=' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(5, 30))),
+                )
+                for _ in range(min(10_000, reviews - start))
+            ])
+        return hotel_ids
+
+    @staticmethod
+    def misspell(rng, word):
+        ## one dropped, doubled or swapped letter after the first
+        position = rng.randrange(1, len(word) - 1)
+        return rng.choice((
+            word[:position] + word[position + 1:],
+            word[:position] + word[position] + word[position:],
+            word[:position] + word[position + 1] + word[position] + word[position + 2:],
+        ))
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from reservation import benchmarks
+from reservation.models import Hotel, Room, Review
+from reservation.renderers import JSONRenderer
+from reservation.serializers import HotelSerializers, RoomSerializer, ReviewSerializer
+from reservation.sparse import columns_for
+
+
+def annotations(serializer_class):
+    found = {}
+    for extra in getattr(serializer_class.Meta, 'sparse_annotations', {}).values():
+        found.update(extra)
+    return found
+
+
+def as_rows(queryset, serializer_class):
+    ## the .values() query a list_rows view runs for the serializer's fields (see sparse.py)
+    extra = annotations(serializer_class)
+    return queryset.annotate(**extra).values(*columns_for(serializer_class()), *extra)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serializing large lists from model instances and from .values() rows (rows.py), "
+        "query and JSON rendering included, on a seeded dataset that is rolled back afterwards. "
+        "Fails if the two ever render different bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='rows per serialization')
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument('--json', help='write the results to this file')
+        parser.add_argument('--baseline', help='fail if results regress against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            dataset = benchmarks.seed(hotels=rows, rooms=1, users=20, bookings=0, reviews=rows)
+            hotels = Hotel.objects.filter(pk__in=dataset.hotel_ids).order_by('-id')
+            rooms = Room.objects.filter(pk__in=dataset.room_ids).order_by('room_number', 'id')
+            reviews = Review.objects.filter(hotel_id__in=dataset.hotel_ids).order_by('-created_at', '-id')
+            cases = [
+                ('HotelSerializers', HotelSerializers, hotels.select_related('owner'), hotels),
+                ('RoomSerializer', RoomSerializer, rooms, rooms),
+                ('ReviewSerializer', ReviewSerializer, reviews.select_related('hotel'), reviews),
+            ]
+            results = {}
+            for name, serializer_class, instances, values in cases:
+                instances = instances.annotate(**annotations(serializer_class))
+                values = as_rows(values, serializer_class)
+                slow = self.render(serializer_class, instances)
+                if self.render(serializer_class, values) != slow:
+                    raise CommandError(f"{name} renders rows differently from instances")
+                results[f'{name} x{rows} instances'] = self.measure(lambda: self.render(serializer_class, instances), options)
+                results[f'{name} x{rows} rows'] = self.measure(lambda: self.render(serializer_class, values), options)
+            transaction.set_rollback(True)
+
+        for label, summary in results.items():
+            self.stdout.write(benchmarks.format_summary(label, summary))
+        if options['json']:
+            benchmarks.save_results(options['json'], results)
+        if options['baseline']:
+            found = benchmarks.regressions(results, options['baseline'], options['tolerance'])
+            if found:
+                raise CommandError("Regressions:\n" + "\n".join(found))
+
+    def render(self, serializer_class, queryset):
+        ## a fresh queryset each time, so every run pays for its query
+        return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+    def measure(self, bench, options):
+        for _ in range(options['warmup']):
+            bench()
+        latencies = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            bench()
+            latencies.append(time.perf_counter() - started)
+        return benchmarks.summarize(latencies, sum(latencies))
@@ -0,0 +1,101 @@
+import datetime
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as StockRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from reservation import benchmarks, tokens
+from reservation.models import User
+
+JTI_PREFIX = 'bench-'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure refresh-token rotation throughput with simplejwt's stock blacklist check and with the "
+        "bloom filter, against a table of seeded outstanding tokens (e.g. --outstanding 10000000)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--outstanding', type=int, default=100_000, help='seeded outstanding tokens')
+        parser.add_argument('--blacklisted', type=float, default=0.5, help='share of the seeded tokens blacklisted')
+        parser.add_argument('--refreshes', type=int, default=1000, help='rotations per variant')
+        parser.add_argument('--keep', action='store_true', help='keep the seeded tokens for the next run')
+        parser.add_argument('--json', help='write the results to this file')
+        parser.add_argument('--baseline', help='fail if results regress against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f'{benchmarks.SEED_PREFIX}{time.time_ns()}-tokens')
+        try:
+            self.seed(user, options['outstanding'], options['blacklisted'])
+
+            began = time.perf_counter()
+            tokens.blacklist_filter.load()
+            self.stdout.write(f"bloom filter load: {time.perf_counter() - began:.2f}s for {tokens.blacklist_filter.bloom.count} tokens")
+
+            results = {
+                'refresh stock': self.rotate(StockRefreshSerializer, user, options['refreshes']),
+                'refresh bloom': self.rotate(tokens.TokenRefreshSerializer, user, options['refreshes']),
+            }
+        finally:
+            OutstandingToken.objects.filter(user=user).delete()
+            if not options['keep']:
+                while OutstandingToken.objects.filter(jti__startswith=JTI_PREFIX).exists():
+                    ids = OutstandingToken.objects.filter(jti__startswith=JTI_PREFIX).values_list('id', flat=True)[:10000]
+                    OutstandingToken.objects.filter(id__in=list(ids)).only('id').delete()
+            user.delete()
+
+        for label, summary in results.items():
+            self.stdout.write(benchmarks.format_summary(label, summary))
+        if options['json']:
+            benchmarks.save_results(options['json'], results)
+        if options['baseline']:
+            found = benchmarks.regressions(results, options['baseline'], options['tolerance'])
+            if found:
+                raise CommandError("Regressions:\n" + "\n".join(found))
+
+    def seed(self, user, outstanding, blacklisted):
+        ## seeded tokens are kept with --keep, so only the shortfall is created
+        missing = outstanding - OutstandingToken.objects.filter(jti__startswith=JTI_PREFIX).count()
+        expires = timezone.now() + datetime.timedelta(days=7)
+        every = round(1 / blacklisted) if blacklisted else 0
+        began = time.perf_counter()
+        for start in range(0, max(missing, 0), 10000):
+            with transaction.atomic():
+                created = OutstandingToken.objects.bulk_create([
+                    OutstandingToken(jti=f'{JTI_PREFIX}{uuid.uuid4().hex}', token='', expires_at=expires)
+                    for _ in range(min(10000, missing - start))
+                ])
+                if every:
+                    ids = [token.pk for token in created[::every]]
+                    if None in ids:
+                        ids = OutstandingToken.objects.filter(jti__in=[token.jti for token in created[::every]]).values_list('id', flat=True)
+                    BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=token_id) for token_id in ids])
+        if missing > 0:
+            self.stdout.write(f"seeded {missing} outstanding tokens in {time.perf_counter() - began:.1f}s")
+
+    def rotate(self, serializer_class, user, refreshes):
+        refresh = str(serializer_class.token_class.for_user(user))
+        first = refresh
+        latencies = []
+        for _ in range(refreshes):
+            began = time.perf_counter()
+            serializer = serializer_class(data={'refresh': refresh})
+            serializer.is_valid(raise_exception=True)
+            latencies.append(time.perf_counter() - began)
+            refresh = serializer.validated_data['refresh']
+
+        ## a rotated-out token must be refused
+        try:
+            serializer_class(data={'refresh': first}).is_valid()
+        except TokenError:
+            pass
+        else:
+            raise CommandError(f"{serializer_class.__module__} accepted a blacklisted refresh token")
+        return benchmarks.summarize(latencies, sum(latencies))
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservation.exports import EXPORTS, ExportFilterSerializer, encode, export_rows
+
+
+class Command(BaseCommand):
+    help = "Stream bookings or payments to a CSV/NDJSON file (or stdout) in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(EXPORTS))
+        parser.add_argument('--format', default='csv', help='csv or ndjson')
+        parser.add_argument('--from', dest='date_from', help='created on or after, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='created on or before, YYYY-MM-DD')
+        parser.add_argument('--hotel', type=int)
+        parser.add_argument('--status')
+        parser.add_argument('--output', help='file to write; stdout when omitted')
+
+    def handle(self, *args, **options):
+        params = ExportFilterSerializer(data={
+            'output': options['format'],
+            **{key: options[key] for key in ('date_from', 'date_to', 'hotel', 'status') if options[key] is not None},
+        })
+        if not params.is_valid():
+            raise CommandError(params.errors)
+        filters = dict(params.validated_data)
+        format = filters.pop('output')
+
+        headers, rows = export_rows(options['export'], **filters)
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for line in encode(format, headers, rows):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,135 @@
+import datetime
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from reservation import benchmarks
+from reservation.benchmarks import LOCATIONS
+from reservation.models import User
+
+STEPS = ('search', 'book', 'pay', 'callback')
+
+
+class Command(BaseCommand):
+    help = (
+        "In-process load test of the guest journey: search free rooms, book one, create the payment and "
+        "deliver the eSewa callback, from concurrent virtual users. Reports throughput and p50/p95/p99 per "
+        "step. Needs a file or server database (DB_NAME=/tmp/load.sqlite3 or DB_ENGINE=postgres)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+        parser.add_argument('--journeys', type=int, default=25, help='journeys per virtual user')
+        parser.add_argument('--hotels', type=int, default=50)
+        parser.add_argument('--rooms', type=int, default=20, help='rooms per hotel')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='keep the seeded data')
+        parser.add_argument('--json', help='write the results to this file')
+        parser.add_argument('--baseline', help='fail if results regress against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in ('', ':memory:'):
+            raise CommandError("An in-memory database cannot be shared between threads; set DB_NAME to a file.")
+
+        dataset = benchmarks.seed(
+            hotels=options['hotels'], rooms=options['rooms'], users=options['users'],
+            bookings=0, reviews=options['hotels'] * 5, seed=options['seed'],
+        )
+        latencies = defaultdict(list)
+        outcomes = defaultdict(int)
+        lock = threading.Lock()
+        today = datetime.date.today()
+
+        def virtual_user(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            client = Client()
+            user = User.objects.get(pk=dataset.user_ids[index % len(dataset.user_ids)])
+            auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+            timings = defaultdict(list)
+            counts = defaultdict(int)
+
+            def timed(step, call):
+                began = time.perf_counter()
+                response = call()
+                timings[step].append(time.perf_counter() - began)
+                return response
+
+            try:
+                for _ in range(options['journeys']):
+                    check_in = today + datetime.timedelta(days=rng.randrange(1, 365))
+                    check_out = check_in + datetime.timedelta(days=rng.randint(1, 5))
+                    dates = {'check_in': check_in.isoformat(), 'check_out': check_out.isoformat()}
+
+                    response = timed('search', lambda: client.get(
+                        '/rooms/available/', {**dates, 'location': rng.choice(LOCATIONS)},
+                    ))
+                    rooms = [room['id'] for room in response.json()['results']] if response.status_code == 200 else []
+                    if not rooms:
+                        counts['no rooms'] += 1
+                        continue
+
+                    response = timed('book', lambda: client.post('/bookings/', {
+                        'room': rng.choice(rooms), 'checked_in_date': dates['check_in'], 'checked_out_date': dates['check_out'],
+                    }, content_type='application/json', **auth))
+                    if response.status_code != 201:
+                        ## another virtual user took the room between search and booking
+                        counts['rejected' if response.status_code == 400 else 'errors'] += 1
+                        continue
+                    booking = response.json()
+
+                    response = timed('pay', lambda: client.post(
+                        f"/bookings/{booking['id']}/payments/", {'payment_choices': 'ESEWA'},
+                        content_type='application/json', **auth,
+                    ))
+                    if response.status_code != 201:
+                        counts['errors'] += 1
+                        continue
+                    payment = response.json()
+
+                    response = timed('callback', lambda: client.post('/esewa/callback/', {
+                        'pid': payment['id'], 'refId': uuid.uuid4().hex, 'amt': payment['amount'], 'status': 'success',
+                    }, content_type='application/json'))
+                    counts['completed' if response.status_code == 202 else 'errors'] += 1
+            finally:
+                close_old_connections()
+                with lock:
+                    for step, values in timings.items():
+                        latencies[step].extend(values)
+                    for outcome, count in counts.items():
+                        outcomes[outcome] += count
+
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                began = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['users']) as pool:
+                    list(pool.map(virtual_user, range(options['users'])))
+                elapsed = time.perf_counter() - began
+        finally:
+            if not options['keep']:
+                dataset.delete()
+
+        results = {step: benchmarks.summarize(latencies[step], elapsed) for step in STEPS if latencies[step]}
+        journeys = options['users'] * options['journeys']
+        self.stdout.write(f"users={options['users']} journeys={journeys} elapsed={elapsed:.2f}s")
+        for step, summary in results.items():
+            self.stdout.write(benchmarks.format_summary(step, summary))
+        self.stdout.write(' '.join(f"{outcome}={count}" for outcome, count in sorted(outcomes.items())))
+
+        if options['json']:
+            benchmarks.save_results(options['json'], results)
+        if outcomes['errors']:
+            raise CommandError(f"{outcomes['errors']} journeys failed")
+        if options['baseline']:
+            found = benchmarks.regressions(results, options['baseline'], options['tolerance'])
+            if found:
+                raise CommandError("Regressions:\n" + "\n".join(found))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reservation.payments import drain
+
+
+class Command(BaseCommand):
+    help = "Apply queued payment gateway callbacks to their payments, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--once', action='store_true', help='drain the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = drain(options['batch_size'])
+            if processed:
+                self.stdout.write(f"Applied {processed} callbacks.")
+            if options['once']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
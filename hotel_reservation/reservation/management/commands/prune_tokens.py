@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reservation.tokens import prune_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding and blacklisted refresh tokens, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--interval', type=float, default=0, help='keep pruning every this many seconds; 0 prunes once')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = prune_expired(options['batch_size'])
+            self.stdout.write(f"Pruned {deleted} expired tokens.")
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
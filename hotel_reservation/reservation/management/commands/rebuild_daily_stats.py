@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from reservation import analytics
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily occupancy/revenue rollups from bookings and payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel', type=int, action='append', dest='hotels', help='limit to this hotel (repeatable)')
+
+    def handle(self, *args, **options):
+        count = analytics.rebuild(options['hotels'])
+        self.stdout.write(f"Rebuilt daily stats from {count} bookings.")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reservation import cache
+from reservation.models import Hotel, Room
+
+
+class Command(BaseCommand):
+    help = "Recompute the review count, rating sum, histogram and average of every hotel and room from the reviews table."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            hotels = Hotel.rebuild_ratings()
+            rooms = Room.rebuild_ratings()
+        cache.touch(cache.HOTELS)
+        self.stdout.write(f"Rebuilt rating aggregates for {hotels} hotels and {rooms} rooms.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from reservation import inventory
+
+
+class Command(BaseCommand):
+    help = "Recreate the per-night room inventory from active bookings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel', type=int, action='append', dest='hotels', help='limit to this hotel (repeatable)')
+
+    def handle(self, *args, **options):
+        count = inventory.rebuild(options['hotels'])
+        self.stdout.write(f"Rebuilt room nights from {count} bookings.")
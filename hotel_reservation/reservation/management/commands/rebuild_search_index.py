@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from reservation import search
+
+
+class Command(BaseCommand):
+    help = "Recreate the hotel and review full-text index, e.g. after bulk loads that skip the signals."
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(f"Rebuilt the search index over {count} hotels.")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from reservation import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs, including the recurring booking lifecycle sweeps."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='jobs to run before checking the queue again')
+        parser.add_argument('--once', action='store_true', help='run the jobs that are due once and exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds to sleep when no job is due')
+        parser.add_argument('--enqueue', action='append', default=[], metavar='NAME', help='queue this job to run now')
+
+    def handle(self, *args, **options):
+        for name in options['enqueue']:
+            if name not in jobs.REGISTRY:
+                raise CommandError(f"No job named {name!r}; known jobs: {', '.join(sorted(jobs.REGISTRY))}")
+            jobs.enqueue(name)
+        jobs.schedule()
+        while True:
+            ran = jobs.run_due(options['limit'])
+            if ran:
+                self.stdout.write(f"Ran {ran} jobs.")
+            if options['once'] and not ran:
+                return
+            close_old_connections()
+            if not ran:
+                time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from reservation.benchmarks import seed, SEED_PREFIX
+from reservation.models import User
+
+
+class Command(BaseCommand):
+    help = "Seed hotels, rooms, users, reviews, bookings and payments for performance work."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, default=50)
+        parser.add_argument('--rooms', type=int, default=20, help='rooms per hotel')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--bookings', type=int, default=500, help='stays attempted; overlapping ones are skipped')
+        parser.add_argument('--reviews', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0, help='the same seed produces the same data')
+        parser.add_argument('--flush', action='store_true', help='delete previously seeded data first')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            deleted, _ = User.objects.filter(username__startswith=SEED_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted} seeded rows.")
+        dataset = seed(
+            hotels=options['hotels'], rooms=options['rooms'], users=options['users'],
+            bookings=options['bookings'], reviews=options['reviews'], seed=options['seed'],
+        )
+        self.stdout.write(
+            f"Seeded {len(dataset.hotel_ids)} hotels, {len(dataset.room_ids)} rooms, "
+            f"{len(dataset.user_ids)} users and {len(dataset.booking_ids)} bookings."
+        )
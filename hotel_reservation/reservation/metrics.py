@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from .db import pinned
+
+## Request and query instrumentation.
+##
+## RequestMetricsMiddleware times every request and counts its queries and their time. Requests
+## are keyed by the router basename of the view (hotel, hotel-rooms, bookings, booking-payments,
+## ...) and the viewset action, or by the url name for plain views. Each response carries a
+## Server-Timing header; totals accumulate in a per-process registry that metrics/ renders in the
+## Prometheus text format. Queries slower than SLOW_QUERY_MS are logged to
+## 'reservation.slow_queries' with the application frames that ran them.
+##
+## Every database connection gets an execute wrapper when it is created (instrument) that reports
+## to the request being served, found through a ContextVar: under ASGI an async view's queries run
+## on a connection of the request's sync thread, which the middleware cannot reach. A streamed
+## response (an export) is recorded when it is closed, with the queries its body ran; its
+## Server-Timing header can only tell the time to the first byte.
+
+logger = logging.getLogger('reservation.slow_queries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+## frames from these paths say nothing about which of our code ran the query
+_LIBRARY_PATHS = ('site-packages', 'dist-packages')
+LABELS = ('view', 'action', 'method')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Registry:
+    """Per-process totals, keyed by (view, action, method)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latency = {}
+        self.queries = {}
+        self.sql_seconds = {}
+        self.slow_queries = {}
+        self.responses = {}
+
+    def record(self, labels, status, duration, stats):
+        with self.lock:
+            if labels not in self.latency:
+                self.latency[labels] = Histogram(LATENCY_BUCKETS)
+                self.queries[labels] = Histogram(QUERY_COUNT_BUCKETS)
+                self.sql_seconds[labels] = 0.0
+                self.slow_queries[labels] = 0
+            self.latency[labels].observe(duration)
+            self.queries[labels].observe(stats.count)
+            self.sql_seconds[labels] += stats.seconds
+            self.slow_queries[labels] += stats.slow
+            self.responses[labels + (status,)] = self.responses.get(labels + (status,), 0) + 1
+
+    def render(self):
+        lines = []
+
+        def labelled(names, values, extra=''):
+            pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+            return '{' + pairs + (',' if pairs and extra else '') + extra + '}'
+
+        def histogram(name, help_text, series):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} histogram'])
+            for labels, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + ('+Inf',), hist.counts + [hist.count - sum(hist.counts)]):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f'{name}_bucket{labelled(LABELS, labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{labelled(LABELS, labels)} {hist.sum}')
+                lines.append(f'{name}_count{labelled(LABELS, labels)} {hist.count}')
+
+        def counter(name, help_text, series, names=None):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+            for labels, value in sorted(series.items()):
+                lines.append(f'{name}{labelled(names or LABELS, labels)} {value}')
+
+        with self.lock:
+            histogram('http_request_duration_seconds', 'Time spent serving requests.', self.latency)
+            histogram('http_request_db_queries', 'Database queries run per request.', self.queries)
+            counter('http_request_db_seconds_total', 'Time spent in database queries.', self.sql_seconds)
+            counter('http_request_slow_queries_total', 'Queries slower than SLOW_QUERY_MS.', self.slow_queries)
+            counter('http_responses_total', 'Responses by status code.', self.responses, LABELS + ('status',))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryStats:
+    """Execute wrapper that counts and times the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+        self.slow_after = getattr(settings, 'SLOW_QUERY_MS', None)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.slow_after is not None and elapsed * 1000 >= self.slow_after:
+                self.slow += 1
+                self.log_slow(sql, elapsed, context['connection'].alias)
+
+    def log_slow(self, sql, elapsed, alias):
+        base = str(settings.BASE_DIR)
+        frames = [
+            frame for frame in traceback.extract_stack()[:-2]
+            if frame.filename.startswith(base) and frame.filename != __file__
+            and not any(path in frame.filename for path in _LIBRARY_PATHS)
+        ]
+        depth = getattr(settings, 'SLOW_QUERY_STACK_DEPTH', 5)
+        origin = ' <- '.join(
+            f'{frame.filename[len(base) + 1:]}:{frame.lineno} {frame.name}' for frame in reversed(frames[-depth:])
+        )
+        logger.warning('slow query %.1fms on %s: %s [%s]', elapsed * 1000, alias, sql, origin or 'no application frames')
+
+
+_request_stats = ContextVar('request_query_stats', default=None)
+
+
+def _report(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def instrument(connection, **kwargs):
+    ## connection_created receiver (see apps.py); first in the list, so wrappers installed with
+    ## `with connection.execute_wrapper(...)` are still the ones their exit pops
+    if _report not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _report)
+
+
+def view_labels(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ('unmatched', '', request.method)
+    basename = getattr(match.func, 'initkwargs', {}).get('basename')
+    if basename:
+        actions = getattr(match.func, 'actions', None) or {}
+        return (basename, actions.get(request.method.lower(), ''), request.method)
+    return (match.url_name or match.view_name, '', request.method)
+
+
+class RequestMetricsMiddleware:
+    ## runs in the mode of the handler, so async views under ASGI are not pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, started = QueryStats(), time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, started = QueryStats(), time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, '
+            f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'
+        )
+        labels = view_labels(request)
+        if not response.streaming:
+            registry.record(labels, response.status_code, duration, stats)
+            return response
+        ## the server closes the response once the whole body is sent, the test client again after it
+        close, recorded = response.close, []
+
+        def closed():
+            try:
+                close()
+            finally:
+                if not recorded:
+                    recorded.append(True)
+                    registry.record(labels, response.status_code, time.perf_counter() - started, stats)
+
+        response.close = closed
+        return pinned(response, _request_stats, stats)
+
+
+def metrics_view(request):
+    ## metrics/ for Prometheus: scrapers send METRICS_TOKEN as a bearer token; with no token set
+    ## only clients in INTERNAL_IPS may read it
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'INTERNAL_IPS', ())
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hotel',
+            name='location',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['room', 'status', 'checked_in_date', 'checked_out_date'], name='booking_room_status_dates_idx'),
+        ),
+    ]
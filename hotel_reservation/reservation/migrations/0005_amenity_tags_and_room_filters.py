@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+def backfill_amenity_tags(apps, schema_editor):
+    Amenity = apps.get_model('reservation', 'Amenity')
+    for model_name in ('Hotel', 'Room'):
+        model = apps.get_model('reservation', model_name)
+        through = model.amenity_tags.through
+        owner = f'{model._meta.model_name}_id'
+        rows = []
+        for pk, text in model.objects.values_list('pk', 'amenities').iterator():
+            for name in {part.strip().lower() for part in (text or '').split(',') if part.strip()}:
+                amenity, _ = Amenity.objects.get_or_create(name=name)
+                rows.append(through(**{owner: pk, 'amenity_id': amenity.pk}))
+        through.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0004_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Amenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='amenity_tags',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='hotels', to='reservation.amenity'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='amenity_tags',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='rooms', to='reservation.amenity'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['room_type', 'price_per_night'], name='room_type_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['price_per_night'], name='room_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['capacity'], name='room_capacity_idx'),
+        ),
+        migrations.RunPython(backfill_amenity_tags, migrations.RunPython.noop),
+    ]
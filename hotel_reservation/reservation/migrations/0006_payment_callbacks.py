@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0005_amenity_tags_and_room_filters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.UUIDField()),
+                ('transaction_id', models.CharField(max_length=100, unique=True)),
+                ('succeeded', models.BooleanField()),
+                ('amount', models.CharField(blank=True, max_length=20)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(blank=True, choices=[('APPLIED', 'Applied'), ('IGNORED', 'Ignored'), ('UNKNOWN_PAYMENT', 'Unknown payment')], max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='callback_pending_idx')],
+            },
+        ),
+    ]
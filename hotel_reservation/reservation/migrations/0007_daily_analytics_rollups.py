@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0006_payment_callbacks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('nights_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='reservation.hotel')),
+            ],
+            options={
+                'unique_together': {('hotel', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('nights_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_daily_stats', to='reservation.hotel')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='reservation.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hotel', 'date'], name='roomstat_hotel_date_idx')],
+                'unique_together': {('room', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0007_daily_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='reservation.booking')),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='reservation.hotel')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='reservation.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hotel', 'date'], name='roomnight_hotel_date_idx')],
+                'unique_together': {('room', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:06
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0008_room_night_inventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatePlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('room_type', models.CharField(blank=True, choices=[('SINGLE', 'Single'), ('DOUBLE', 'Double'), ('SUITE', 'Suite'), ('DELUXE', 'Deluxe')], help_text='blank for every room type', max_length=12)),
+                ('start_date', models.DateField(blank=True, help_text='first night covered; blank for no start', null=True)),
+                ('end_date', models.DateField(blank=True, help_text='last night covered; blank for no end', null=True)),
+                ('multiplier', models.DecimalField(decimal_places=3, default=1, max_digits=5, validators=[django.core.validators.MinValueValidator(0)])),
+                ('weekend_multiplier', models.DecimalField(decimal_places=3, default=1, help_text='applied on top of multiplier for Friday and Saturday nights', max_digits=5, validators=[django.core.validators.MinValueValidator(0)])),
+                ('priority', models.IntegerField(default=0, help_text='where plans overlap the highest priority wins')),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_plans', to='reservation.hotel')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OccupancySurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_occupancy', models.PositiveSmallIntegerField(help_text='percentage of the hotel rooms already booked for the night', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('multiplier', models.DecimalField(decimal_places=3, max_digits=5, validators=[django.core.validators.MinValueValidator(1)])),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy_surges', to='reservation.hotel')),
+            ],
+            options={
+                'unique_together': {('hotel', 'min_occupancy')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StayDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_nights', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(2)])),
+                ('percent', models.DecimalField(decimal_places=2, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stay_discounts', to='reservation.hotel')),
+            ],
+            options={
+                'unique_together': {('hotel', 'min_nights')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    ## prune_tokens deletes by expires_at, which simplejwt does not index
+
+    dependencies = [
+        ('reservation', '0009_pricing_rules'),
+        ('token_blacklist', '0013_alter_blacklistedtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS outstandingtoken_expires_idx ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX IF EXISTS outstandingtoken_expires_idx',
+        ),
+    ]
@@ -0,0 +1,75 @@
+from django.db import migrations
+
+## Side tables for reservation/search.py. Other databases get no index and search with icontains.
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE reservation_hotel_search USING fts5("
+    "name, description, location, amenities, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+    ## name and location again, so matches on them can be read without the descriptions
+    "CREATE VIRTUAL TABLE reservation_hotel_names USING fts5("
+    "name, location, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+    "CREATE VIRTUAL TABLE reservation_review_search USING fts5("
+    "comment, hotel, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+    ## the indexed words by first letter and length, for typo corrections
+    'CREATE TABLE reservation_hotel_search_terms (initial text, size integer, term text, PRIMARY KEY (initial, size, term)) WITHOUT ROWID',
+    'CREATE TABLE reservation_review_search_terms (initial text, size integer, term text, PRIMARY KEY (initial, size, term)) WITHOUT ROWID',
+    "INSERT INTO reservation_hotel_search (rowid, name, description, location, amenities) "
+    "SELECT id, name, description, location, amenities FROM reservation_hotel",
+    "INSERT INTO reservation_hotel_names (rowid, name, location) SELECT id, name, location FROM reservation_hotel",
+    "INSERT INTO reservation_review_search (rowid, comment, hotel) SELECT id, comment, CAST(hotel_id AS TEXT) FROM reservation_review",
+    "CREATE VIRTUAL TABLE temp.hotel_vocabulary USING fts5vocab(main, reservation_hotel_search, 'row')",
+    "INSERT INTO reservation_hotel_search_terms SELECT substr(term, 1, 1), length(term), term FROM temp.hotel_vocabulary",
+    'DROP TABLE temp.hotel_vocabulary',
+    "CREATE VIRTUAL TABLE temp.review_vocabulary USING fts5vocab(main, reservation_review_search, 'col')",
+    "INSERT OR IGNORE INTO reservation_review_search_terms "
+    "SELECT substr(term, 1, 1), length(term), term FROM temp.review_vocabulary WHERE col = 'comment'",
+    'DROP TABLE temp.review_vocabulary',
+]
+SQLITE_REVERSE = [
+    'DROP TABLE IF EXISTS reservation_hotel_search_terms',
+    'DROP TABLE IF EXISTS reservation_hotel_search',
+    'DROP TABLE IF EXISTS reservation_hotel_names',
+    'DROP TABLE IF EXISTS reservation_review_search_terms',
+    'DROP TABLE IF EXISTS reservation_review_search',
+]
+
+POSTGRES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE TABLE reservation_hotel_search (hotel_id bigint PRIMARY KEY, document tsvector NOT NULL, words text NOT NULL)',
+    'CREATE INDEX hotel_search_document_idx ON reservation_hotel_search USING gin (document)',
+    'CREATE INDEX hotel_search_words_idx ON reservation_hotel_search USING gin (words gin_trgm_ops)',
+    'CREATE TABLE reservation_review_search (review_id bigint PRIMARY KEY, hotel_id bigint NOT NULL, document tsvector NOT NULL)',
+    'CREATE INDEX review_search_document_idx ON reservation_review_search USING gin (document)',
+    'CREATE INDEX review_search_hotel_idx ON reservation_review_search (hotel_id)',
+    "INSERT INTO reservation_hotel_search (hotel_id, document, words) SELECT id, "
+    "setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', location), 'B') || "
+    "setweight(to_tsvector('simple', amenities), 'C') || setweight(to_tsvector('simple', description), 'D'), "
+    "name || ' ' || location FROM reservation_hotel",
+    "INSERT INTO reservation_review_search (review_id, hotel_id, document) "
+    "SELECT id, hotel_id, to_tsvector('simple', comment) FROM reservation_review",
+]
+POSTGRES_REVERSE = [
+    'DROP TABLE IF EXISTS reservation_hotel_search',
+    'DROP TABLE IF EXISTS reservation_review_search',
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0010_outstanding_token_expiry_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE, 'postgresql': POSTGRES}),
+            run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:59
+
+import reservation.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0013_job_queue_and_lifecycle_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hotel',
+            name='amenities',
+            field=models.TextField(help_text='Comma-separated list of amenities', validators=[reservation.models.validate_amenities]),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='amenities',
+            field=models.CharField(blank=True, help_text='room-specific amenities', max_length=100, validators=[reservation.models.validate_amenities]),
+        ),
+    ]
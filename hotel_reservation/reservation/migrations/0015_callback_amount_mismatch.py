@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0014_amenity_name_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentcallback',
+            name='outcome',
+            field=models.CharField(blank=True, choices=[('APPLIED', 'Applied'), ('IGNORED', 'Ignored'), ('UNKNOWN_PAYMENT', 'Unknown payment'), ('AMOUNT_MISMATCH', 'Amount mismatch')], max_length=20),
+        ),
+    ]
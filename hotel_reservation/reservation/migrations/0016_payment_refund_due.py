@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+def rename_job(old, new):
+    ## queued runs of the sweep under its old name would fail as unknown jobs
+    def apply(apps, schema_editor):
+        apps.get_model('reservation', 'Job').objects.filter(name=old, status='QUEUED').update(name=new)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0015_callback_amount_mismatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('REFUND_DUE', 'Refund due'), ('REFUNDED', 'Refunded')], default='PENDING', max_length=12),
+        ),
+        migrations.RunPython(
+            rename_job('refund_cancelled', 'flag_refunds_due'),
+            rename_job('flag_refunds_due', 'refund_cancelled'),
+        ),
+    ]
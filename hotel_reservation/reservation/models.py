@@ -1,8 +1,17 @@
-from django.db import models
+from django.db import models, transaction, OperationalError
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.dispatch import Signal
+from django.utils import timezone
+from collections import defaultdict
+import random
+import time
 import uuid
 
+from . import geo
+
 # Create your models here.
 
 class User(AbstractUser):
@@ -33,20 +42,192 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.username} ({self.role})"
 
-class Hotel(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        ## hotels show it as owner_name, see signals.py
+        instance._first_name_as = instance.__dict__.get('first_name')
+        return instance
+
+class RatingAggregate(models.Model):
+    """
+    Denormalized review totals, kept in step by the Review signals and rebuilt
+    from scratch with ``manage.py rebuild_rating_aggregates``.
+    """
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}') for star in range(1, 6)}
+
+    @classmethod
+    def adjust_rating(cls, pk, rating, delta):
+        ## one UPDATE; every SET expression sees the row's old values, including the average
+        count = models.F('review_count') + delta
+        total = models.F('rating_sum') + rating * delta
+        cls.objects.filter(pk=pk).update(
+            review_count=count,
+            rating_sum=total,
+            **{f'rating_{rating}': models.F(f'rating_{rating}') + delta},
+            average_rating=Coalesce(
+                Cast(total, models.FloatField()) / NullIf(count, 0),
+                models.Value(0.0),
+            ),
+        )
+
+    @classmethod
+    def rebuild_ratings(cls, pks=None):
+        """
+        Recompute the aggregates from the reviews table, for every row or only ``pks``.
+        Needed after reviews are written without signals (bulk_create, raw SQL).
+        """
+        field = cls._meta.model_name
+        stars = range(1, 6)
+        fresh = dict(review_count=0, rating_sum=0, average_rating=0, **{f'rating_{star}': 0 for star in stars})
+        targets = cls.objects.all() if pks is None else cls.objects.filter(pk__in=pks)
+        reviews = Review.objects.filter(**{f'{field}__isnull': False})
+        if pks is not None:
+            reviews = reviews.filter(**{f'{field}__in': pks})
+
+        totals = reviews.values(field).order_by().annotate(
+            review_count=models.Count('id'),
+            rating_sum=models.Sum('rating'),
+            **{f'rating_{star}': models.Count('id', filter=models.Q(rating=star)) for star in stars},
+        )
+        with transaction.atomic():
+            targets.update(**fresh)
+            updated = []
+            for row in totals.iterator(chunk_size=2000):
+                instance = cls(pk=row.pop(field), **row)
+                instance.average_rating = round(instance.rating_sum / instance.review_count, 2)
+                updated.append(instance)
+            cls.objects.bulk_update(updated, list(fresh), batch_size=500)
+        return len(updated)
+
+
+## longest amenity name; Amenity.name is a column of this length
+AMENITY_NAME_LENGTH = 50
+
+
+def parse_amenities(text):
+    ## "WiFi, Pool,wifi" -> ['pool', 'wifi']
+    return sorted({part.strip().lower() for part in (text or '').split(',') if part.strip()})
+
+
+def validate_amenities(text):
+    ## on the amenities fields and the amenities filter, so a long name never reaches the tag tables
+    too_long = [name for name in parse_amenities(text) if len(name) > AMENITY_NAME_LENGTH]
+    if too_long:
+        raise ValidationError(
+            f"Amenity names are limited to {AMENITY_NAME_LENGTH} characters: {', '.join(too_long)}",
+            code='max_length',
+        )
+
+
+class AmenityQuerySet(models.QuerySet):
+    def for_names(self, names):
+        ## {name: Amenity}, creating any names not seen before
+        names = set(names)
+        if names:
+            self.bulk_create([Amenity(name=name) for name in names], ignore_conflicts=True)
+        return {amenity.name: amenity for amenity in self.filter(name__in=names)}
+
+
+class Amenity(models.Model):
+    name = models.CharField(max_length=AMENITY_NAME_LENGTH, unique=True)
+
+    objects = AmenityQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+
+def tag_amenities(instances):
+    """
+    Rebuild the amenity_tags rows of hotels or rooms (all of one model) from their
+    comma-separated ``amenities`` text. Works for a single save or a bulk_create batch.
+    """
+    if not instances:
+        return
+    through = type(instances[0]).amenity_tags.through
+    owner = f'{type(instances[0])._meta.model_name}_id'
+    wanted = {instance.pk: parse_amenities(instance.amenities) for instance in instances}
+    tags = Amenity.objects.for_names(name for names in wanted.values() for name in names)
+
+    through.objects.filter(**{f'{owner}__in': list(wanted)}).delete()
+    through.objects.bulk_create([
+        through(**{owner: pk, 'amenity_id': tags[name].pk})
+        for pk, names in wanted.items() for name in names
+    ])
+
+
+class Hotel(RatingAggregate):
     name = models.CharField(max_length=50)
     description = models.TextField()
-    location = models.CharField(max_length=50)
+    location = models.CharField(max_length=50, db_index=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     email_address = models.EmailField(blank=True, null=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='hotels')
-    amenities = models.TextField(help_text= "Comma-separated list of amenities")
+    amenities = models.TextField(help_text= "Comma-separated list of amenities", validators=[validate_amenities])
+    ## normalized copy of amenities for indexed filtering, see tag_amenities()
+    amenity_tags = models.ManyToManyField(Amenity, related_name='hotels', blank=True, editable=False)
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    ## grid cell of latitude/longitude for proximity search, see geo.py
+    geo_cell = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return f"{self.name}"
+
+    def save(self, *args, **kwargs):
+        self.geo_cell = geo.cell(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geo_cell'}
+        return super().save(*args, **kwargs)
     
     
-class Room(models.Model):
+class RoomQuerySet(models.QuerySet):
+    def matching(self, room_type=None, min_capacity=None, max_capacity=None, min_price=None, max_price=None,
+                 amenities=(), location=None):
+        ## every filter is an indexed comparison; amenities are EXISTS probes on the tag tables
+        rooms = self
+        if room_type:
+            rooms = rooms.filter(room_type=room_type)
+        if min_capacity is not None:
+            rooms = rooms.filter(capacity__gte=min_capacity)
+        if max_capacity is not None:
+            rooms = rooms.filter(capacity__lte=max_capacity)
+        if min_price is not None:
+            rooms = rooms.filter(price_per_night__gte=min_price)
+        if max_price is not None:
+            rooms = rooms.filter(price_per_night__lte=max_price)
+        if location:
+            rooms = rooms.filter(hotel__location=location)
+        for name in amenities:
+            ## a room has an amenity if it lists it or its hotel does
+            in_room = Room.amenity_tags.through.objects.filter(room=models.OuterRef('pk'), amenity__name=name)
+            in_hotel = Hotel.amenity_tags.through.objects.filter(hotel=models.OuterRef('hotel'), amenity__name=name)
+            rooms = rooms.filter(models.Exists(in_room) | models.Exists(in_hotel))
+        return rooms
+
+    def available_between(self, check_in, check_out):
+        ## a room is free when no active booking overlaps [check_in, check_out)
+        clashing = Booking.objects.overlapping(check_in, check_out).filter(room=models.OuterRef('pk'))
+        return self.filter(is_available=True).exclude(models.Exists(clashing))
+
+
+class Room(RatingAggregate):
     ROOM_CHOICES = (
         ('SINGLE', 'Single'),
         ('DOUBLE', 'Double'),
@@ -59,15 +240,162 @@ class Room(models.Model):
     capacity = models.PositiveIntegerField(default=1)
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
     is_available = models.BooleanField(default=True)
-    amenities = models.CharField(max_length=100, blank=True, help_text='room-specific amenities')
+    amenities = models.CharField(max_length=100, blank=True, help_text='room-specific amenities', validators=[validate_amenities])
+    amenity_tags = models.ManyToManyField(Amenity, related_name='rooms', blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RoomQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.hotel.name} - Room {self.room_number} ({self.room_type})"
     
     class Meta:
         unique_together = ['hotel', 'room_number']
         ordering = ['hotel', 'room_number']
+        indexes = [
+            models.Index(fields=['room_type', 'price_per_night'], name='room_type_price_idx'),
+            models.Index(fields=['price_per_night'], name='room_price_idx'),
+            models.Index(fields=['capacity'], name='room_capacity_idx'),
+        ]
+
+
+## Pricing rules. A night costs price_per_night times the multiplier of the rate plan covering it
+## and the occupancy surge in force; the stay total then gets the best length-of-stay discount.
+## pricing.py precomputes the daily multipliers per hotel and room type.
+
+class RatePlan(models.Model):
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='rate_plans')
+    name = models.CharField(max_length=100)
+    room_type = models.CharField(max_length=12, choices=Room.ROOM_CHOICES, blank=True, help_text='blank for every room type')
+    start_date = models.DateField(null=True, blank=True, help_text='first night covered; blank for no start')
+    end_date = models.DateField(null=True, blank=True, help_text='last night covered; blank for no end')
+    multiplier = models.DecimalField(max_digits=5, decimal_places=3, default=1, validators=[MinValueValidator(0)])
+    weekend_multiplier = models.DecimalField(
+        max_digits=5, decimal_places=3, default=1, validators=[MinValueValidator(0)],
+        help_text='applied on top of multiplier for Friday and Saturday nights',
+    )
+    priority = models.IntegerField(default=0, help_text='where plans overlap the highest priority wins')
+
+    def __str__(self):
+        return f"{self.hotel.name} - {self.name}"
+
+
+class StayDiscount(models.Model):
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='stay_discounts')
+    min_nights = models.PositiveIntegerField(validators=[MinValueValidator(2)])
+    percent = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0), MaxValueValidator(100)])
+
+    class Meta:
+        unique_together = ['hotel', 'min_nights']
+
+
+class OccupancySurge(models.Model):
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='occupancy_surges')
+    min_occupancy = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text='percentage of the hotel rooms already booked for the night',
+    )
+    multiplier = models.DecimalField(max_digits=5, decimal_places=3, validators=[MinValueValidator(1)])
+
+    class Meta:
+        unique_together = ['hotel', 'min_occupancy']
+
+## sent with bookings=[...] after Booking.objects.reserve_many()
+bookings_bulk_created = Signal()
+
+
+class RoomAlreadyBooked(Exception):
+    def __init__(self, message, conflicts=None):
+        super().__init__(message)
+        ## for batch reservations: {index in the batch: reason}
+        self.conflicts = conflicts or {}
+
+
+class BookingQuerySet(models.QuerySet):
+    ## how many times a reservation is retried when the database reports lock contention
+    RESERVE_ATTEMPTS = 5
+
+    def overlapping(self, check_in, check_out):
+        ## stays are half-open, so checking out on a day frees the room for that night
+        return self.filter(
+            status__in=Booking.ACTIVE_STATUSES,
+            checked_in_date__lt=check_out,
+            checked_out_date__gt=check_in,
+        )
+
+    def _retry_on_contention(self, reservation):
+        ## lock timeouts and serialization failures are retried with a jittered backoff
+        for attempt in range(1, self.RESERVE_ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    return reservation()
+            except OperationalError:
+                if attempt == self.RESERVE_ATTEMPTS:
+                    raise
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+    def reserve(self, room, checked_in_date, checked_out_date, **fields):
+        """
+        Create a booking unless another active booking overlaps the stay.
+
+        The room row is locked for the duration of the check-and-insert, so concurrent
+        reservations serialize per room while other rooms book in parallel.
+        """
+        def reservation():
+            locked_room = Room.objects.select_for_update().only('id', 'hotel_id', 'room_type', 'price_per_night').get(pk=room.pk)
+            if self.overlapping(checked_in_date, checked_out_date).filter(room=locked_room).exists():
+                raise RoomAlreadyBooked(f"Room {room.pk} is already booked for these dates")
+            return self.create(
+                room=locked_room,
+                checked_in_date=checked_in_date,
+                checked_out_date=checked_out_date,
+                **fields,
+            )
+
+        return self._retry_on_contention(reservation)
+
+    def reserve_many(self, stays):
+        """
+        Create a batch of bookings in one transaction, or none of them.
+
+        ``stays`` is a list of dicts with ``room``, ``checked_in_date``, ``checked_out_date``
+        and any other Booking fields. All rooms are locked and checked against existing
+        bookings with one query each; stays in the batch are also checked against each other.
+        """
+        def reservation():
+            room_ids = sorted({stay['room'].pk for stay in stays})
+            ## lock in pk order so two overlapping batches cannot deadlock
+            locked = Room.objects.select_for_update().only('id', 'hotel_id', 'room_type', 'price_per_night').filter(pk__in=room_ids).order_by('pk')
+            rooms = {room.pk: room for room in locked}
+
+            taken = defaultdict(list)
+            first_night = min(stay['checked_in_date'] for stay in stays)
+            last_checkout = max(stay['checked_out_date'] for stay in stays)
+            existing = self.filter(room_id__in=room_ids).overlapping(first_night, last_checkout)
+            for room_id, check_in, check_out in existing.values_list('room_id', 'checked_in_date', 'checked_out_date'):
+                taken[room_id].append((check_in, check_out))
+
+            conflicts = {}
+            bookings = []
+            for index, stay in enumerate(stays):
+                room = rooms[stay['room'].pk]
+                check_in, check_out = stay['checked_in_date'], stay['checked_out_date']
+                if any(start < check_out and end > check_in for start, end in taken[room.pk]):
+                    conflicts[index] = f"Room {room.pk} is already booked for these dates"
+                    continue
+                taken[room.pk].append((check_in, check_out))
+                bookings.append(self.model(**{**stay, 'room': room}))
+
+            if conflicts:
+                raise RoomAlreadyBooked(f"{len(conflicts)} stays clash with existing bookings", conflicts)
+            Booking.price_stays(bookings)
+            created = self.bulk_create(bookings)
+            ## bulk_create sends no post_save; analytics and inventory listen for this instead
+            bookings_bulk_created.send(sender=Booking, bookings=created)
+            return created
+
+        return self._retry_on_contention(reservation)
+
 
 class Booking(models.Model):
     STATUS_CHOICES = (
@@ -85,12 +413,68 @@ class Booking(models.Model):
     checked_out_date = models.DateField()
     nights = models.PositiveIntegerField(editable=False)
 
+    objects = BookingQuerySet.as_manager()
+
+    ## statuses that hold the room; cancelled bookings free it up again
+    ACTIVE_STATUSES = ('PENDING', 'COMPLETED')
+    PRICING_FIELDS = {'room', 'checked_in_date', 'checked_out_date'}
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['room', 'status', 'checked_in_date', 'checked_out_date'],
+                name='booking_room_status_dates_idx',
+            ),
+            models.Index(fields=['created_at', 'id'], name='booking_created_idx'),
+            ## the lifecycle sweeps (see lifecycle.py) only look at pending bookings
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='PENDING'), name='booking_pending_created_idx'),
+            models.Index(fields=['checked_out_date', 'id'], condition=models.Q(status='PENDING'), name='booking_pending_checkout_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._priced_as = instance._pricing_key()
+        instance._stay_as = instance.stay_key()
+        return instance
+
+    def _pricing_key(self):
+        ## read from __dict__ so deferred fields are not fetched just to compare them
+        return tuple(self.__dict__.get(field) for field in ('room_id', 'checked_in_date', 'checked_out_date'))
+
+    def stay_key(self):
+        ## what this booking contributes to the daily analytics rollups; None when it holds no room
+        if self.__dict__.get('status') not in self.ACTIVE_STATUSES:
+            return None
+        return self._pricing_key() + (self.__dict__.get('nights'), self.__dict__.get('total_amount'))
+
+    @staticmethod
+    def price_stays(bookings):
+        ## pricing.py reads the rule models, so it is imported when first needed
+        from .pricing import price_bookings
+        price_bookings(bookings)
+
+    def price_stay(self):
+        self.price_stays([self])
 
     def save(self, *args, **kwargs):
-        if self.checked_in_date and self.checked_out_date:
-            self.nights = (self.checked_out_date - self.checked_in_date).days
-            self.total_amount = self.nights * self.room.price_per_night
-        return super().save(*args, **kwargs)
+        ## price the stay on creation or when room/dates change; status-only saves never touch the room
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not self.PRICING_FIELDS & set(update_fields):
+            reprice = False
+        else:
+            reprice = self._state.adding or self._pricing_key() != getattr(self, '_priced_as', None)
+
+        if reprice and self.checked_in_date and self.checked_out_date:
+            self.price_stay()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'nights', 'total_amount'}
+
+        ## atomic so the post_save bookkeeping (room-night inventory, analytics) commits with the row
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+        self._priced_as = self._pricing_key()
+        return result
 
 
 class Payment(models.Model):
@@ -104,6 +488,7 @@ class Payment(models.Model):
         ('PENDING', 'Pending'),
         ('COMPLETED', 'Completed'),
         ('FAILED', 'Failed'),
+        ('REFUND_DUE', 'Refund due'),
         ('REFUNDED', 'Refunded'),
     )
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -114,12 +499,120 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._status_as = instance.__dict__.get('status')
+        return instance
+
     def save(self, *args, **kwargs):
-        self.amount = self.booking.total_amount
+        ## the amount is fixed when the payment is created; later saves are status updates
+        update_fields = kwargs.get('update_fields')
+        if (self._state.adding or self.amount is None) and (update_fields is None or 'amount' in update_fields):
+            self.amount = self.booking.total_amount
         return super().save(*args, **kwargs)
 
 
 
+class RoomNight(models.Model):
+    """
+    One row per room per night held by an active booking, maintained by inventory.py.
+    A free night has no row, so a hotel's calendar is one query joining its rooms to a
+    range of the unique (room, date) index, which also refuses a second booking of a night.
+    """
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='nights')
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='room_nights')
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='room_nights')
+    date = models.DateField()
+
+    class Meta:
+        unique_together = ['room', 'date']
+        indexes = [
+            models.Index(fields=['hotel', 'date'], name='roomnight_hotel_date_idx'),
+        ]
+
+
+class PaymentCallback(models.Model):
+    """
+    A gateway notification, stored as received and applied to its Payment later by
+    the callback worker (see payments.py). transaction_id is unique, so gateway
+    retries of the same notification are dropped at insert time. Failures that
+    carry no gateway reference are keyed by the order (see failure_key).
+    """
+    OUTCOME_CHOICES = (
+        ('APPLIED', 'Applied'),
+        ('IGNORED', 'Ignored'),
+        ('UNKNOWN_PAYMENT', 'Unknown payment'),
+        ('AMOUNT_MISMATCH', 'Amount mismatch'),
+    )
+    FAILURE_PREFIX = 'failed:'
+    payment_id = models.UUIDField()
+    transaction_id = models.CharField(max_length=100, unique=True)
+    succeeded = models.BooleanField()
+    amount = models.CharField(max_length=20, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, blank=True)
+
+    class Meta:
+        indexes = [
+            ## the worker's queue: only unprocessed rows are in this index
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='callback_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} -> {self.payment_id}"
+
+    @classmethod
+    def failure_key(cls, payment_id):
+        return f"{cls.FAILURE_PREFIX}{payment_id}"
+
+    @property
+    def reference(self):
+        ## the gateway's own id for the transaction, if it sent one
+        if self.transaction_id.startswith(self.FAILURE_PREFIX):
+            return None
+        return self.transaction_id
+
+
+class Job(models.Model):
+    """
+    A unit of background work for `manage.py run_jobs`, see jobs.py. Recurring jobs put
+    their next run in the queue when they finish.
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    ## a running job whose worker died is claimed again once this passes
+    locked_until = models.DateTimeField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            ## the workers' queue: finished jobs are not in this index
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status__in=['QUEUED', 'RUNNING']), name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} at {self.run_at:%Y-%m-%d %H:%M} ({self.status})"
+
+
 class Review(models.Model):
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='hotel_reviews')
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='room_reviews', blank=True, null=True)
@@ -128,9 +621,51 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     rating = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rated_as = instance._rating_key()
+        return instance
+
+    def _rating_key(self):
+        ## what this review currently contributes to the hotel/room aggregates
+        return tuple(self.__dict__.get(field) for field in ('hotel_id', 'room_id', 'rating'))
+
     class Meta:
         ordering =['-created_at'] 
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='review_created_idx'),
+        ]
+
+
+
+## Analytics and tracking
+## Daily rollups of sold room-nights and revenue, kept current by analytics.py so reports over
+## long ranges read one row per hotel (or room) per day instead of scanning bookings.
+
+class DailyStat(models.Model):
+    date = models.DateField()
+    nights_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
 
 
+class HotelDailyStat(DailyStat):
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='daily_stats')
+
+    class Meta:
+        unique_together = ['hotel', 'date']
 
-## Analytics and tracking, to be added in future
+
+class RoomDailyStat(DailyStat):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='daily_stats')
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='room_daily_stats')
+
+    class Meta:
+        unique_together = ['room', 'date']
+        indexes = [
+            models.Index(fields=['hotel', 'date'], name='roomstat_hotel_date_idx'),
+        ]
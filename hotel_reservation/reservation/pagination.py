@@ -0,0 +1,141 @@
+from base64 import b64decode
+from functools import reduce
+from operator import or_
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+
+## Keyset pagination: every page is a "WHERE (a, b) > cursor ORDER BY a, b LIMIT n" on an indexed
+## column list, so page 10,000 costs the same as page 1.
+##
+## DRF's CursorPagination only filters on the first ordering column and steps over rows that tie
+## on it with an OFFSET, capped at 1000, so a long run of equal values (room "101" in every hotel
+## of a city) repeats or breaks pages. KeysetCursorPagination puts the value of every ordering
+## column in the cursor instead; orderings end on the pk (added when they do not already), so
+## no two rows share a position and no offset is ever needed.
+
+
+class KeysetCursorPagination(CursorPagination):
+
+    def paginate_queryset(self, queryset, request, view=None):
+        query = self.page_query(queryset, request, view)
+        if query is None:
+            return None
+        return self.set_page(list(query))
+
+    def page_query(self, queryset, request, view=None):
+        ## the query for the page and one row more; async views run it themselves and hand the
+        ## rows to set_page
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if self.cursor is not None:
+            queryset = queryset.filter(self.after(self.cursor.position, reverse))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.page = results[:self.page_size]
+        more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, self.cursor is not None
+        ## an empty page (the rows behind a cursor were deleted) pages on from the cursor itself
+        position = self.cursor.position if self.cursor else None
+        self.next_position = self.position(self.page[-1]) if self.page else position
+        self.previous_position = self.position(self.page[0]) if self.page else position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        ## an ?ordering= picked from the view's ordering_fields (average_rating, ...) need not be
+        ## unique, so the pk is added to it, in the direction of its first column
+        ordering = super().get_ordering(request, queryset, view)
+        pk = queryset.model._meta.pk.name
+        if not {pk, 'pk'} & {order.lstrip('-') for order in ordering}:
+            ordering += ('-' + pk if ordering[0].startswith('-') else pk,)
+        return ordering
+
+    def after(self, position, reverse):
+        ## (a, b, c) beyond the cursor: a past it, or a equal and b past it, or ...; the leading
+        ## a >= bound lets the database seek on the index rather than scan for the ORs
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        terms, equal = [], {}
+        try:
+            for order, value in zip(self.ordering, position):
+                name = order.lstrip('-')
+                lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+                terms.append(Q(**equal, **{f'{name}__{lookup}': value}))
+                equal[name] = value
+            first = self.ordering[0].lstrip('-')
+            bound = Q(**{f"{first}__{'lte' if self.ordering[0].startswith('-') != reverse else 'gte'}": position[0]})
+            return bound & reduce(or_, terms)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def position(self, instance):
+        ## rows are model instances, or the dicts of list_rows views (see sparse.py)
+        values = []
+        for order in self.ordering:
+            name = order.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            if value is None:
+                raise ValueError(f"Cursor ordering column {name!r} is NULL")
+            values.append(str(value))
+        return values
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    def decode_cursor(self, request):
+        ## the position is every ordering value, sent as a repeated 'p'
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=tokens.get('p', []))
+
+
+class CreatedAtCursorPagination(KeysetCursorPagination):
+    ## bookings, payments and reviews, newest first; pk breaks created_at ties
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class HotelCursorPagination(CreatedAtCursorPagination):
+    ordering = ('-id',)
+
+
+class RoomCursorPagination(CreatedAtCursorPagination):
+    ## room numbers repeat across hotels (every hotel has a "101"), so id orders the rooms that
+    ## share one; within a hotel the (hotel, room_number) unique index serves the cursor
+    ordering = ('room_number', 'id')
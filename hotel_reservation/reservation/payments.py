@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import analytics
+from .models import Payment, PaymentCallback
+
+logger = logging.getLogger(__name__)
+
+## Gateway callbacks are acknowledged as soon as they are stored in PaymentCallback; this module
+## applies them to payments in batches, either from a background thread in the web process
+## (PAYMENT_CALLBACK_WORKER = 'thread') or from `manage.py process_payment_callbacks`.
+
+## status a payment is in -> statuses a gateway callback may move it to
+TRANSITIONS = {
+    'PENDING': {'COMPLETED', 'FAILED'},
+    'FAILED': {'COMPLETED'},  # the customer retried and paid
+    'COMPLETED': set(),
+    'REFUND_DUE': set(),
+    'REFUNDED': set(),
+}
+
+
+def paid(callback):
+    try:
+        return Decimal(callback.amount)
+    except InvalidOperation:
+        return None
+
+
+def process_callbacks(batch_size=500):
+    """
+    Apply the oldest unprocessed callbacks and return how many were handled. Several
+    workers can run at once: each claims its batch with SKIP LOCKED where supported.
+    """
+    with transaction.atomic():
+        batch = list(
+            PaymentCallback.objects.filter(processed_at__isnull=True)
+            .order_by('id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        payments = Payment.objects.only('id', 'booking_id', 'amount', 'status', 'transaction_id').in_bulk(
+            {callback.payment_id for callback in batch}
+        )
+        outcomes = defaultdict(list)
+        changed = {}
+        ## in arrival order, so a later callback for the same payment sees the earlier transition
+        for callback in batch:
+            payment = payments.get(callback.payment_id)
+            if payment is None:
+                outcomes['UNKNOWN_PAYMENT'].append(callback.pk)
+                continue
+            target = 'COMPLETED' if callback.succeeded else 'FAILED'
+            if target not in TRANSITIONS.get(payment.status, ()):
+                outcomes['IGNORED'].append(callback.pk)
+                continue
+            ## a payment completes only for the amount it was created with
+            if callback.succeeded and paid(callback) != payment.amount:
+                outcomes['AMOUNT_MISMATCH'].append(callback.pk)
+                continue
+            payment.status = target
+            payment.transaction_id = callback.reference or payment.transaction_id
+            changed[payment.pk] = payment
+            outcomes['APPLIED'].append(callback.pk)
+
+        Payment.objects.bulk_update(changed.values(), ['status', 'transaction_id'])
+        ## bulk_update sends no post_save, so feed newly collected revenue to the rollups here
+        analytics.record_payments([
+            (payment.booking_id, payment.amount, 1) for payment in changed.values()
+            if payment.status == 'COMPLETED' and payment._status_as != 'COMPLETED'
+        ])
+        for payment in changed.values():
+            payment._status_as = payment.status
+        now = timezone.now()
+        for outcome, ids in outcomes.items():
+            PaymentCallback.objects.filter(pk__in=ids).update(processed_at=now, outcome=outcome)
+    return len(batch)
+
+
+def drain(batch_size=500):
+    processed = 0
+    while True:
+        handled = process_callbacks(batch_size)
+        if not handled:
+            return processed
+        processed += handled
+
+
+class CallbackWorker:
+    ## collect a burst for this long before draining, so it is applied in a few batches
+    BATCH_WINDOW = 0.05
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def notify(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='payment-callbacks', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.BATCH_WINDOW)
+            self._wake.clear()
+            try:
+                drain()
+            except Exception:
+                logger.exception("Applying payment callbacks failed; they stay queued for the next run")
+            finally:
+                close_old_connections()
+
+
+worker = CallbackWorker()
+
+
+def callback_received():
+    if getattr(settings, 'PAYMENT_CALLBACK_WORKER', 'thread') == 'thread':
+        worker.notify()
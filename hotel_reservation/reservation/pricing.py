@@ -0,0 +1,180 @@
+import datetime
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Count
+
+from . import cache
+from .models import Room, RoomNight, RatePlan, StayDiscount, OccupancySurge
+
+## Dynamic pricing.
+##
+## A night costs price_per_night times a daily multiplier: the multiplier of the rate plan covering
+## it (weekend nights also take the plan's weekend multiplier), times the occupancy surge in force.
+## The stay total then gets the hotel's best length-of-stay discount and is rounded once, to cents.
+##
+## Rate plans only change when someone edits them, so the plan multipliers are precomputed into
+## one table per hotel, room type and year and kept in the catalogue cache under the hotel's
+## pricing version stamp (bumped by signals.py when a rule changes). Quoting a batch of stays
+## turns each (hotel, room type) table into running sums over each run of nearby dates the batch
+## covers, after which every stay costs one subtraction however long it is. Occupancy moves with every booking,
+## so surges are read live: one grouped query over RoomNight for the whole batch.
+
+ONE_DAY = datetime.timedelta(days=1)
+ONE = Decimal(1)
+CENT = Decimal('0.01')
+## nights starting on Friday and Saturday
+WEEKEND_NIGHTS = (4, 5)
+TABLE_TIMEOUT = 24 * 60 * 60
+## stays this close together share one run of sums; the days between them are summed for nothing
+CLUSTER_GAP = datetime.timedelta(days=31)
+## quotes/ prices stays starting within this many days of today, either way
+QUOTE_HORIZON_DAYS = 3 * 366
+
+
+def _rules(hotel_ids):
+    """{hotel_id: (stamp, plans, discounts, surges)}, loading hotels missing from the cache in three queries."""
+    store = cache.catalogue_cache()
+    stamps = dict(zip(hotel_ids, cache.versions(*(cache.pricing_scope(hotel_id) for hotel_id in hotel_ids))))
+    keys = {f'pricing:rules:{hotel_id}:{stamps[hotel_id]}': hotel_id for hotel_id in hotel_ids}
+    rules = {keys[key]: value for key, value in store.get_many(keys).items()}
+
+    missing = [hotel_id for hotel_id in hotel_ids if hotel_id not in rules]
+    if missing:
+        loaded = {hotel_id: (stamps[hotel_id], [], [], []) for hotel_id in missing}
+        plans = RatePlan.objects.filter(hotel_id__in=missing).values_list(
+            'hotel_id', 'room_type', 'start_date', 'end_date', 'multiplier', 'weekend_multiplier', 'priority',
+        ).order_by('id')
+        for hotel_id, *plan in plans:
+            loaded[hotel_id][1].append(tuple(plan))
+        discounts = StayDiscount.objects.filter(hotel_id__in=missing).values_list('hotel_id', 'min_nights', 'percent')
+        for hotel_id, min_nights, percent in discounts.order_by('-min_nights'):
+            loaded[hotel_id][2].append((min_nights, percent))
+        surges = OccupancySurge.objects.filter(hotel_id__in=missing).values_list('hotel_id', 'min_occupancy', 'multiplier')
+        for hotel_id, min_occupancy, multiplier in surges.order_by('-min_occupancy'):
+            loaded[hotel_id][3].append((min_occupancy, multiplier))
+        store.set_many({f'pricing:rules:{hotel_id}:{stamps[hotel_id]}': value for hotel_id, value in loaded.items()}, TABLE_TIMEOUT)
+        rules.update(loaded)
+    return rules
+
+
+def _year_table(plans, room_type, year):
+    first_day = datetime.date(year, 1, 1)
+    last_day = datetime.date(year, 12, 31)
+    table = [ONE] * ((last_day - first_day).days + 1)
+    ## plans are painted lowest priority first, so the winner is written last; at equal priority
+    ## a plan for this room type beats one for every type
+    applicable = [plan for plan in plans if plan[0] in ('', room_type)]
+    applicable.sort(key=lambda plan: (plan[5], plan[0] != ''))
+    for _, start, end, multiplier, weekend, _ in applicable:
+        start = max(start or first_day, first_day)
+        end = min(end or last_day, last_day)
+        ## by offset, as stepping a day at a time would run past date.max at the end of 9999
+        for offset in range((start - first_day).days, (end - first_day).days + 1):
+            weekday = (first_day.weekday() + offset) % 7
+            table[offset] = multiplier * weekend if weekday in WEEKEND_NIGHTS else multiplier
+    return tuple(table)
+
+
+def rate_tables(rules, keys):
+    """{(hotel_id, room_type, year): daily plan multipliers for that year}, cached per pricing version."""
+    store = cache.catalogue_cache()
+    cache_keys = {f'pricing:table:{hotel_id}:{rules[hotel_id][0]}:{room_type}:{year}': (hotel_id, room_type, year) for hotel_id, room_type, year in keys}
+    tables = {cache_keys[key]: table for key, table in store.get_many(cache_keys).items()}
+    built = {
+        key: (hotel_id, room_type, year)
+        for key, (hotel_id, room_type, year) in cache_keys.items()
+        if (hotel_id, room_type, year) not in tables
+    }
+    for key, (hotel_id, room_type, year) in built.items():
+        tables[hotel_id, room_type, year] = _year_table(rules[hotel_id][1], room_type, year)
+    if built:
+        store.set_many({key: tables[built[key]] for key in built}, TABLE_TIMEOUT)
+    return tables
+
+
+def _surges(rules, stays, exclude):
+    """{(hotel_id, date): surge multiplier} for every night of ``stays`` at a hotel with surge rules."""
+    hotel_ids = {room.hotel_id for room, _, _ in stays if rules[room.hotel_id][3]}
+    if not hotel_ids:
+        return {}
+    first_night = min(check_in for room, check_in, _ in stays if room.hotel_id in hotel_ids)
+    last_checkout = max(check_out for room, _, check_out in stays if room.hotel_id in hotel_ids)
+
+    room_counts = dict(Room.objects.filter(hotel_id__in=hotel_ids).values_list('hotel_id').annotate(Count('id')).order_by())
+    ## the stays being priced may already hold nights (a booking changing its dates); they do not count
+    held = RoomNight.objects.filter(hotel_id__in=hotel_ids, date__gte=first_night, date__lt=last_checkout)
+    held = held.exclude(booking_id__in=[pk for pk in exclude if pk is not None])
+    surges = {}
+    for hotel_id, date, booked in held.values_list('hotel_id', 'date').annotate(Count('id')).order_by():
+        for min_occupancy, multiplier in rules[hotel_id][3]:
+            if booked * 100 >= min_occupancy * room_counts[hotel_id]:
+                surges[hotel_id, date] = multiplier
+                break
+    return surges
+
+
+def quote(stays, exclude=()):
+    """
+    Price ``stays``, a list of (room, check_in, check_out); rooms need hotel_id, room_type and
+    price_per_night loaded. Returns the totals in the same order. Nights held by the bookings
+    in ``exclude`` are left out of the occupancy used for surges.
+    """
+    if not stays:
+        return []
+    rules = _rules(sorted({room.hotel_id for room, _, _ in stays}))
+
+    ## {(hotel_id, room_type): [[first night, last checkout], ...]}, stays merged into runs of nearby dates
+    windows = {}
+    for room, check_in, check_out in sorted(stays, key=lambda stay: stay[1]):
+        runs = windows.setdefault((room.hotel_id, room.room_type), [])
+        if runs and check_in - runs[-1][1] <= CLUSTER_GAP:
+            runs[-1][1] = max(runs[-1][1], check_out)
+        else:
+            runs.append([check_in, check_out])
+    tables = rate_tables(rules, {
+        (hotel_id, room_type, year)
+        for (hotel_id, room_type), runs in windows.items()
+        for first, last in runs
+        for year in range(first.year, (last - ONE_DAY).year + 1)
+    })
+    surges = _surges(rules, stays, exclude)
+
+    ## sums[i] is the sum of the nightly multipliers from the start of the run up to night i
+    running = {}
+    for (hotel_id, room_type), runs in windows.items():
+        starts, run_sums = running[hotel_id, room_type] = ([], [])
+        for first, last in runs:
+            sums, total = [Decimal(0)], Decimal(0)
+            for offset in range((last - first).days):
+                day = first + datetime.timedelta(days=offset)
+                rate = tables[hotel_id, room_type, day.year][day.timetuple().tm_yday - 1]
+                total += rate * surges.get((hotel_id, day), ONE)
+                sums.append(total)
+            starts.append(first)
+            run_sums.append(sums)
+
+    totals = []
+    for room, check_in, check_out in stays:
+        starts, run_sums = running[room.hotel_id, room.room_type]
+        index = bisect_right(starts, check_in) - 1
+        first, sums = starts[index], run_sums[index]
+        amount = room.price_per_night * (sums[(check_out - first).days] - sums[(check_in - first).days])
+        nights = (check_out - check_in).days
+        for min_nights, percent in rules[room.hotel_id][2]:
+            if nights >= min_nights:
+                amount -= amount * percent / 100
+                break
+        totals.append(amount.quantize(CENT, rounding=ROUND_HALF_UP))
+    return totals
+
+
+def price_bookings(bookings):
+    """Set nights and total_amount on each booking."""
+    totals = quote(
+        [(booking.room, booking.checked_in_date, booking.checked_out_date) for booking in bookings],
+        exclude=[booking.pk for booking in bookings],
+    )
+    for booking, total in zip(bookings, totals):
+        booking.nights = (booking.checked_out_date - booking.checked_in_date).days
+        booking.total_amount = total
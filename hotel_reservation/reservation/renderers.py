@@ -0,0 +1,54 @@
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # falls back to DRF's json.dumps renderer
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # the msgpack renderer is only offered when it is installed, see settings.py
+    msgpack = None
+
+## Response encodings, picked from the Accept header (or ?format=json / ?format=msgpack).
+##
+## JSONRenderer writes the same bytes as DRF's renderer, with orjson doing the work when it is
+## installed: types orjson does not know (Decimal, lazy strings) and datetimes, which DRF writes
+## with a 'Z' suffix, go through DRF's encoder. MessagePackRenderer writes the same values as
+## binary msgpack, which is smaller and cheaper to parse on mobile clients.
+## Compression is negotiated separately, see compression.py.
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+_encoder = JSONEncoder()
+
+
+class JSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        ## pretty printing (?indent=, the browsable API) is left to json.dumps
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            ## e.g. integers beyond 64 bits, which json.dumps writes
+            return super().render(data, accepted_media_type, renderer_context)
+        ## as DRF does, so the output stays a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        ## values are what the JSON renderer would write: datetimes and decimals as strings or numbers
+        return msgpack.packb(data, default=_encoder.default, datetime=False)
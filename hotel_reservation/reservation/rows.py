@@ -0,0 +1,115 @@
+import datetime
+import decimal
+from operator import itemgetter
+
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+## Read-only serialization straight from .values() rows.
+##
+## Building a model instance per row and resolving every field's attribute through DRF costs more
+## than the query on large lists. A serializer that mixes in RowsMixin also accepts the dicts of
+## .values(), which it turns into its output with a plan compiled once per serializer: which key
+## of the row each field reads, and how its value is converted: not at all for text, numbers,
+## booleans and primary keys, which come out of the database as DRF writes them, and with the
+## per-row lookups of DRF's datetime, decimal and choice fields done once for the others.
+## Fields that are not read from a column (SerializerMethodFields, properties) give a function of
+## the row returning their output in Meta.row_values; their columns are named in Meta.sparse_columns (see sparse.py),
+## which is how views know what to pass to .values(). The output is the same as for instances.
+
+## fields whose to_representation() returns database values of their type unchanged
+PASSTHROUGH = (
+    serializers.CharField, serializers.IntegerField, serializers.FloatField, serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+def _datetime(field):
+    ## the field's timezone and format are looked up once rather than per row
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or zone is None:
+        return field.to_representation
+
+    def convert(value):
+        if not isinstance(value, datetime.datetime) or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(zone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _decimal(field):
+    ## as DecimalField.quantize, with the exponent and context built once
+    if (not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize
+            or field.normalize_output or field.decimal_places is None):
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            return field.to_representation(value)
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def _choice(field):
+    choices = field.choice_strings_to_values
+    return lambda value: value if value == '' else choices.get(str(value), value)
+
+
+CONVERTERS = {
+    serializers.DateTimeField: _datetime,
+    serializers.DecimalField: _decimal,
+    serializers.ChoiceField: _choice,
+}
+
+
+def converter(field):
+    """What turns a database value into the field's output: None when it is written as it is."""
+    for base in type(field).__mro__:
+        if base in CONVERTERS or base in PASSTHROUGH:
+            break
+    else:
+        return field.to_representation
+    ## a subclass that overrides to_representation() keeps it
+    if type(field).to_representation is not base.to_representation:
+        return field.to_representation
+    if base is serializers.PrimaryKeyRelatedField and not field.use_pk_only_optimization():
+        return field.to_representation
+    return None if base in PASSTHROUGH else CONVERTERS[base](field)
+
+
+def compile_plan(serializer):
+    """[(field name, getter of the row, converter or None)] for the serializer's readable fields."""
+    row_values = getattr(serializer.Meta, 'row_values', {})
+    plan = []
+    for field in serializer._readable_fields:
+        name = field.field_name
+        if name in row_values:
+            plan.append((name, row_values[name], None))
+        else:
+            plan.append((name, itemgetter(field.source.replace('.', '__')), converter(field)))
+    return plan
+
+
+class RowsMixin:
+
+    @cached_property
+    def row_plan(self):
+        return compile_plan(self)
+
+    def to_representation(self, instance):
+        if not isinstance(instance, dict):
+            return super().to_representation(instance)
+        ret = {}
+        for name, get, convert in self.row_plan:
+            value = get(instance)
+            ## as Serializer.to_representation does, None is written without converting it
+            ret[name] = value if convert is None or value is None else convert(value)
+        return ret
@@ -0,0 +1,374 @@
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Hotel, Review
+
+## Full-text search over hotels (name, location, amenities, description) and review comments.
+##
+## The index lives in side tables next to the models: FTS5 virtual tables on SQLite, tsvector
+## columns with GIN indexes on Postgres (created by migration 0011), and plain icontains scans on
+## any other database. signals.py re-indexes a hotel or review whenever it is saved or deleted;
+## `manage.py rebuild_search_index` rebuilds everything, e.g. after bulk_create.
+##
+## Queries match every word, the last one as a prefix so the same search serves autocomplete.
+## A word that is not in the index vocabulary (the *_terms tables on SQLite) is replaced by the
+## indexed words within one or two edits of it, so "pokara" still finds Pokhara.
+##
+## Hotels matching on name and location rank above those matching on amenities or the
+## description, and reviews come newest first. On SQLite each tier is read newest first too:
+## bm25 costs a pass over every match (30ms for a city's 16k hotels, 150ms for a common word in
+## 100k descriptions), while reading in rowid order stops after `limit` rows. Postgres ranks
+## hotels with ts_rank_cd over the weighted tsvector.
+
+WORD = re.compile(r'[^\W_]+')
+MAX_RESULTS = 100
+## longest prefix in the FTS5 prefix indexes (prefix='2 3 4' in migration 0011)
+PREFIX_INDEX = 4
+MAX_EXPANSIONS = 50
+
+
+def words(text):
+    ## folded the way the FTS5 unicode61 tokenizer folds them: lower case, accents removed
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return WORD.findall(''.join(letter for letter in text if not unicodedata.combining(letter)))
+
+
+def within_edits(word, candidate, limit):
+    """Levenshtein distance of at most ``limit``, computed only near the diagonal."""
+    if abs(len(word) - len(candidate)) > limit:
+        return False
+    ## each letter that only one of them has needs an edit of its own
+    letters, other = set(word), set(candidate)
+    if len(letters - other) > limit or len(other - letters) > limit:
+        return False
+    ## cells further than `limit` from the diagonal can never come back under it
+    far = limit + 1
+    previous = [j if j <= limit else far for j in range(len(candidate) + 1)]
+    for i, letter in enumerate(word, 1):
+        current = [i if i <= limit else far] + [far] * len(candidate)
+        for j in range(max(1, i - limit), min(len(candidate), i + limit) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (letter != candidate[j - 1]), far)
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def _hotel_text(hotel):
+    return (hotel.name, hotel.description, hotel.location, hotel.amenities)
+
+
+class SearchBackend:
+    """Matching with icontains, for databases without a full-text index."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index_hotels(self, hotels):
+        pass
+
+    def remove_hotels(self, hotel_ids):
+        pass
+
+    def index_reviews(self, reviews):
+        pass
+
+    def remove_reviews(self, review_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def hotels(self, query, limit):
+        hotels = Hotel.objects.using(self.connection.alias)
+        for word in words(query):
+            hotels = hotels.filter(
+                Q(name__icontains=word) | Q(location__icontains=word)
+                | Q(amenities__icontains=word) | Q(description__icontains=word)
+            )
+        return list(hotels.order_by('-average_rating').values_list('pk', flat=True)[:limit])
+
+    def reviews(self, query, limit, hotel_id=None):
+        reviews = Review.objects.using(self.connection.alias)
+        if hotel_id is not None:
+            reviews = reviews.filter(hotel_id=hotel_id)
+        for word in words(query):
+            reviews = reviews.filter(comment__icontains=word)
+        return list(reviews.values_list('pk', flat=True)[:limit])
+
+
+class SQLiteSearch(SearchBackend):
+    ## the FTS5 table and the column of it that the words come from, per index
+    VOCABULARY = {
+        'reservation_hotel_search': ("'row'", ''),
+        'reservation_review_search': ("'col'", "WHERE col = 'comment'"),
+    }
+
+    def _execute(self, sql, params=(), many=False):
+        with self.connection.cursor() as cursor:
+            if many:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def _add_terms(self, table, texts):
+        ## words are never dropped from the terms table; a stale one only costs a correction that matches nothing
+        terms = {word for text in texts for word in words(text)}
+        self._execute(
+            f'INSERT OR IGNORE INTO {table}_terms (initial, size, term) VALUES (%s, %s, %s)',
+            [(term[0], len(term), term) for term in terms], many=True,
+        )
+
+    def index_hotels(self, hotels):
+        hotels = list(hotels)
+        self.remove_hotels([hotel.pk for hotel in hotels])
+        self._execute(
+            'INSERT INTO reservation_hotel_search (rowid, name, description, location, amenities) VALUES (%s, %s, %s, %s, %s)',
+            [(hotel.pk, *_hotel_text(hotel)) for hotel in hotels], many=True,
+        )
+        self._execute(
+            'INSERT INTO reservation_hotel_names (rowid, name, location) VALUES (%s, %s, %s)',
+            [(hotel.pk, hotel.name, hotel.location) for hotel in hotels], many=True,
+        )
+        self._add_terms('reservation_hotel_search', (text for hotel in hotels for text in _hotel_text(hotel)))
+
+    def remove_hotels(self, hotel_ids):
+        for table in ('reservation_hotel_search', 'reservation_hotel_names'):
+            self._execute(f'DELETE FROM {table} WHERE rowid = %s', [(pk,) for pk in hotel_ids], many=True)
+
+    def index_reviews(self, reviews):
+        reviews = list(reviews)
+        self.remove_reviews([review.pk for review in reviews])
+        self._execute(
+            'INSERT INTO reservation_review_search (rowid, comment, hotel) VALUES (%s, %s, %s)',
+            [(review.pk, review.comment, str(review.hotel_id)) for review in reviews], many=True,
+        )
+        self._add_terms('reservation_review_search', (review.comment for review in reviews))
+
+    def remove_reviews(self, review_ids):
+        self._execute('DELETE FROM reservation_review_search WHERE rowid = %s', [(pk,) for pk in review_ids], many=True)
+
+    def rebuild(self):
+        for table in self.VOCABULARY:
+            self._execute(f'DELETE FROM {table}')
+            self._execute(f'DELETE FROM {table}_terms')
+        self._execute('DELETE FROM reservation_hotel_names')
+        self._execute(
+            'INSERT INTO reservation_hotel_search (rowid, name, description, location, amenities) '
+            'SELECT id, name, description, location, amenities FROM reservation_hotel'
+        )
+        self._execute('INSERT INTO reservation_hotel_names (rowid, name, location) SELECT id, name, location FROM reservation_hotel')
+        self._execute("INSERT INTO reservation_hotel_names (reservation_hotel_names) VALUES ('optimize')")
+        self._execute(
+            'INSERT INTO reservation_review_search (rowid, comment, hotel) '
+            'SELECT id, comment, CAST(hotel_id AS TEXT) FROM reservation_review'
+        )
+        for table, (kind, where) in self.VOCABULARY.items():
+            self._execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+            ## the words as FTS5 tokenized them, read once through a throwaway fts5vocab table
+            self._execute(f'CREATE VIRTUAL TABLE temp.{table}_vocabulary USING fts5vocab(main, {table}, {kind})')
+            try:
+                self._execute(
+                    f'INSERT OR IGNORE INTO {table}_terms (initial, size, term) '
+                    f'SELECT substr(term, 1, 1), length(term), term FROM temp.{table}_vocabulary {where}'
+                )
+            finally:
+                self._execute(f'DROP TABLE temp.{table}_vocabulary')
+        return self._execute('SELECT count(*) FROM reservation_hotel_search')[0][0]
+
+    def _match(self, table, query):
+        ## an FTS5 query where every word must match, the last one as a prefix
+        terms = []
+        query_words = words(query)
+        for position, word in enumerate(query_words):
+            if position < len(query_words) - 1:
+                if self._execute(
+                    f'SELECT 1 FROM {table}_terms WHERE initial = %s AND size = %s AND term = %s', (word[0], len(word), word),
+                ):
+                    terms.append(f'"{word}"')
+                    continue
+            else:
+                ## FTS5 reads prefixes of up to PREFIX_INDEX letters from its prefix index; a longer
+                ## one it resolves by merging the full posting lists of every word it covers, so
+                ## those are spelled out as the indexed words instead, read newest first like any OR
+                upper = word[:-1] + chr(ord(word[-1]) + 1)
+                covered = self._execute(
+                    f'SELECT term FROM {table}_terms WHERE initial = %s AND size >= %s AND term >= %s AND term < %s LIMIT %s',
+                    (word[0], len(word), word, upper, MAX_EXPANSIONS + 1),
+                )
+                if covered and (len(word) <= PREFIX_INDEX or len(covered) > MAX_EXPANSIONS):
+                    terms.append(f'"{word}"*')
+                    continue
+                if covered:
+                    terms.append('(' + ' OR '.join(f'"{term}"' for (term,) in covered) + ')')
+                    continue
+            ## unknown word: try the indexed words that start with the same letter and are a typo away
+            limit = 1 if len(word) <= 5 else 2
+            candidates = self._execute(
+                f'SELECT term FROM {table}_terms WHERE initial = %s AND size BETWEEN %s AND %s',
+                (word[0], len(word) - limit, len(word) + limit),
+            )
+            fixes = [term for (term,) in candidates if within_edits(word, term, 1)]
+            if not fixes and limit > 1:
+                fixes = [term for (term,) in candidates if within_edits(word, term, limit)]
+            if not fixes:
+                return None
+            terms.append('(' + ' OR '.join(f'"{term}"' for term in fixes[:MAX_EXPANSIONS]) + ')')
+        return ' AND '.join(terms) or None
+
+    def _newest(self, table, match, limit):
+        ## rowid order walks the posting lists backwards and stops after `limit` rows
+        rows = self._execute(f'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rowid DESC LIMIT %s', (match, limit))
+        return [pk for (pk,) in rows]
+
+    def hotels(self, query, limit):
+        match = self._match('reservation_hotel_search', query)
+        if match is None:
+            return []
+        ## hotels matching on name and location first, then those matching anywhere
+        found = self._newest('reservation_hotel_names', match, limit)
+        if len(found) < limit:
+            seen = set(found)
+            found += [pk for pk in self._newest('reservation_hotel_search', match, limit + len(found)) if pk not in seen]
+        return found[:limit]
+
+    def reviews(self, query, limit, hotel_id=None):
+        match = self._match('reservation_review_search', query)
+        if match is None:
+            return []
+        ## the hotel id is indexed as a token, so one hotel's reviews are an index lookup too
+        match = f'comment : ({match})'
+        if hotel_id is not None:
+            match += f' AND hotel : "{int(hotel_id)}"'
+        return self._newest('reservation_review_search', match, limit)
+
+
+class PostgresSearch(SearchBackend):
+    ## name A, location B, amenities C, description D
+    HOTEL_DOCUMENT = (
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || setweight(to_tsvector('simple', coalesce(%s, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'C') || setweight(to_tsvector('simple', coalesce(%s, '')), 'D')"
+    )
+
+    def _execute(self, sql, params=(), many=False):
+        with self.connection.cursor() as cursor:
+            if many:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+                return cursor.fetchall() if cursor.description else None
+
+    def index_hotels(self, hotels):
+        self._execute(
+            f'INSERT INTO reservation_hotel_search (hotel_id, document, words) VALUES (%s, {self.HOTEL_DOCUMENT}, %s) '
+            'ON CONFLICT (hotel_id) DO UPDATE SET document = EXCLUDED.document, words = EXCLUDED.words',
+            [(hotel.pk, hotel.name, hotel.location, hotel.amenities, hotel.description, f'{hotel.name} {hotel.location}')
+             for hotel in hotels],
+            many=True,
+        )
+
+    def remove_hotels(self, hotel_ids):
+        self._execute('DELETE FROM reservation_hotel_search WHERE hotel_id = ANY(%s)', (list(hotel_ids),))
+
+    def index_reviews(self, reviews):
+        self._execute(
+            "INSERT INTO reservation_review_search (review_id, hotel_id, document) VALUES (%s, %s, to_tsvector('simple', %s)) "
+            'ON CONFLICT (review_id) DO UPDATE SET hotel_id = EXCLUDED.hotel_id, document = EXCLUDED.document',
+            [(review.pk, review.hotel_id, review.comment) for review in reviews],
+            many=True,
+        )
+
+    def remove_reviews(self, review_ids):
+        self._execute('DELETE FROM reservation_review_search WHERE review_id = ANY(%s)', (list(review_ids),))
+
+    def rebuild(self):
+        self._execute('TRUNCATE reservation_hotel_search, reservation_review_search')
+        self._execute(
+            'INSERT INTO reservation_hotel_search (hotel_id, document, words) '
+            f"SELECT id, {self.HOTEL_DOCUMENT % ('name', 'location', 'amenities', 'description')}, name || ' ' || location "
+            'FROM reservation_hotel'
+        )
+        self._execute(
+            "INSERT INTO reservation_review_search (review_id, hotel_id, document) "
+            "SELECT id, hotel_id, to_tsvector('simple', comment) FROM reservation_review"
+        )
+        return self._execute('SELECT count(*) FROM reservation_hotel_search')[0][0]
+
+    def _tsquery(self, query):
+        query_words = words(query)
+        if not query_words:
+            return None
+        return ' & '.join(query_words[:-1] + [f'{query_words[-1]}:*'])
+
+    def hotels(self, query, limit):
+        tsquery = self._tsquery(query)
+        if tsquery is None:
+            return []
+        rows = self._execute(
+            "SELECT hotel_id FROM reservation_hotel_search, to_tsquery('simple', %s) query "
+            'WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC LIMIT %s',
+            (tsquery, limit),
+        )
+        if not rows:
+            ## nothing matched word for word: fall back to trigram similarity on name and location
+            rows = self._execute(
+                'SELECT hotel_id FROM reservation_hotel_search WHERE %s <%% words '
+                'ORDER BY word_similarity(%s, words) DESC LIMIT %s',
+                (query, query, limit),
+            )
+        return [pk for (pk,) in rows]
+
+    def reviews(self, query, limit, hotel_id=None):
+        tsquery = self._tsquery(query)
+        if tsquery is None:
+            return []
+        sql = "SELECT review_id FROM reservation_review_search, to_tsquery('simple', %s) query WHERE document @@ query"
+        params = [tsquery]
+        if hotel_id is not None:
+            sql += ' AND hotel_id = %s'
+            params.append(hotel_id)
+        rows = self._execute(sql + ' ORDER BY review_id DESC LIMIT %s', (*params, limit))
+        return [pk for (pk,) in rows]
+
+
+BACKENDS = {'sqlite': SQLiteSearch, 'postgresql': PostgresSearch}
+
+
+def backend(model=Hotel, write=False):
+    alias = router.db_for_write(model) if write else router.db_for_read(model)
+    connection = connections[alias]
+    return BACKENDS.get(connection.vendor, SearchBackend)(connection)
+
+
+def index_hotels(hotels):
+    backend(write=True).index_hotels(hotels)
+
+
+def remove_hotels(hotel_ids):
+    backend(write=True).remove_hotels(hotel_ids)
+
+
+def index_reviews(reviews):
+    backend(Review, write=True).index_reviews(reviews)
+
+
+def remove_reviews(review_ids):
+    backend(Review, write=True).remove_reviews(review_ids)
+
+
+def rebuild():
+    return backend(write=True).rebuild()
+
+
+def search_hotels(query, limit=20):
+    """Ids of the hotels matching ``query``, best match first."""
+    return backend().hotels(query, min(limit, MAX_RESULTS))
+
+
+def search_reviews(query, limit=20, hotel_id=None):
+    """Ids of the reviews matching ``query``, best match first, optionally of one hotel."""
+    return backend(Review).reviews(query, min(limit, MAX_RESULTS), hotel_id)
@@ -1,5 +1,14 @@
-from .models import User, Hotel, Booking, Room, Payment, Review
+from .models import User, Hotel, Booking, Room, Payment, Review, parse_amenities, validate_amenities
 from rest_framework import serializers
+from datetime import date
+from django.db.models import Count
+from .sparse import SparseFieldsMixin
+from .rows import RowsMixin
+from operator import itemgetter
+from .inventory import MAX_CALENDAR_DAYS
+from .search import MAX_RESULTS
+from .geo import MAX_RADIUS_KM
+from .pricing import QUOTE_HORIZON_DAYS
 
 class UserCreateSerializer(serializers.ModelSerializer):
 
@@ -37,28 +46,151 @@ class UserCreateSerializer(serializers.ModelSerializer):
 
         return user
     
-class HotelSerializers(serializers.ModelSerializer):
+class HotelSerializers(RowsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     owner_name = serializers.SerializerMethodField()
     total_rooms = serializers.SerializerMethodField()
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     class Meta:
         model = Hotel
-        fields = ['name', 'description', 'location','amenities', 'owner_name', 'phone_number', 'email_address', 'total_rooms']
+        fields = ['name', 'description', 'location','amenities', 'owner_name', 'phone_number', 'email_address', 'total_rooms',
+                  'average_rating', 'review_count', 'rating_histogram', 'latitude', 'longitude']
+        read_only_fields = ['average_rating', 'review_count']
+        ## what ?fields= needs to load for fields that are not plain columns (see sparse.py)
+        sparse_columns = {
+            'owner_name': ['owner__first_name'],
+            'total_rooms': [],
+            'rating_histogram': [f'rating_{star}' for star in range(1, 6)],
+        }
+        sparse_annotations = {'total_rooms': {'room_count': Count('rooms')}}
+        ## and how the list endpoint reads them from .values() rows (see rows.py)
+        row_values = {
+            'owner_name': itemgetter('owner__first_name'),
+            'total_rooms': itemgetter('room_count'),
+            'rating_histogram': lambda row: {str(star): row[f'rating_{star}'] for star in range(1, 6)},
+        }
+
+    def validate(self, data):
+        latitude = data.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = data.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("latitude and longitude go together")
+        return data
 
     def get_owner_name(self,obj):
         return obj.owner.first_name
     
     def get_total_rooms(self, obj):
-        return obj.rooms.count()
+        ## HotelView annotates room_count; fall back to a count for freshly saved instances
+        room_count = getattr(obj, 'room_count', None)
+        if room_count is None:
+            return obj.rooms.count()
+        return room_count
     
 ##  hotel/1/room (nested inside of the hotel)
-class RoomSerializer(serializers.ModelSerializer):
+class RoomSerializer(RowsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta: 
         model = Room
         fields = ['room_number', 'room_type', 'capacity', 'is_available', 'price_per_night', 'amenities', 'created_at']
         read_only_fields = ['created_at', 'is_available']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class RoomFilterSerializer(serializers.Serializer):
+    ## query params shared by the hotel, room and availability endpoints
+    room_type = serializers.ChoiceField(choices=Room.ROOM_CHOICES, required=False)
+    min_capacity = serializers.IntegerField(required=False, min_value=1)
+    max_capacity = serializers.IntegerField(required=False, min_value=1)
+    min_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2)
+    max_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2)
+    amenities = serializers.CharField(required=False, help_text='comma-separated, all must match')
+    location = serializers.CharField(required=False, max_length=50)
+
+    def validate_amenities(self, value):
+        validate_amenities(value)
+        return parse_amenities(value)
+
+
+class HotelFilterSerializer(RoomFilterSerializer):
+    ## query params for hotels/, which also narrow by rating
+    min_rating = serializers.DecimalField(required=False, max_digits=3, decimal_places=2, min_value=0, max_value=5)
+
+
+class AvailabilitySearchSerializer(RoomFilterSerializer):
+    ## query params for rooms/available/?check_in=...&check_out=...&hotel=...&location=...
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    hotel = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, data):
+        if data['check_out'] <= data['check_in']:
+            raise serializers.ValidationError("check_out must be after check_in")
+
+        return data
+
+
+class NearbySearchSerializer(RoomFilterSerializer):
+    ## query params for hotels/nearby/?lat=27.71&lng=85.32&radius=5 or ?bbox=south,west,north,east,
+    ## optionally with check_in/check_out and the room filters
+    lat = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    lng = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    radius = serializers.FloatField(required=False, min_value=0.01, max_value=MAX_RADIUS_KM, help_text='km')
+    bbox = serializers.CharField(required=False)
+    limit = serializers.IntegerField(default=50, min_value=1, max_value=100)
+    check_in = serializers.DateField(required=False)
+    check_out = serializers.DateField(required=False)
+
+    def validate_bbox(self, value):
+        try:
+            south, west, north, east = (float(part) for part in value.split(','))
+        except ValueError:
+            raise serializers.ValidationError("expected south,west,north,east")
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise serializers.ValidationError("not a box of latitudes and longitudes")
+        return (south, west, north, east)
+
+    def validate(self, data):
+        if ('lat' in data) != ('lng' in data):
+            raise serializers.ValidationError("lat and lng go together")
+        if 'bbox' not in data:
+            if 'lat' not in data:
+                raise serializers.ValidationError("lat/lng or bbox is required")
+            data.setdefault('radius', 10.0)
+        elif 'lat' not in data:
+            ## a map view: nearest the middle of the box
+            south, west, north, east = data['bbox']
+            data['lat'], data['lng'] = (south + north) / 2, (west + east) / 2
+        if ('check_in' in data) != ('check_out' in data):
+            raise serializers.ValidationError("check_in and check_out go together")
+        if 'check_in' in data and data['check_out'] <= data['check_in']:
+            raise serializers.ValidationError("check_out must be after check_in")
+
+        return data
+
+
+class QuoteStaySerializer(serializers.Serializer):
+    rooms = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+
+    def validate(self, data):
+        if data['check_out'] <= data['check_in']:
+            raise serializers.ValidationError("check_out must be after check_in")
+        if (data['check_out'] - data['check_in']).days > MAX_CALENDAR_DAYS:
+            raise serializers.ValidationError(f"stays are limited to {MAX_CALENDAR_DAYS} nights")
+        if abs((data['check_in'] - date.today()).days) > QUOTE_HORIZON_DAYS:
+            raise serializers.ValidationError(f"check_in must be within {QUOTE_HORIZON_DAYS} days of today")
+
+        return data
+
+
+class AvailableRoomSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    hotel_name = serializers.CharField(source='hotel.name', read_only=True)
+    class Meta:
+        model = Room
+        fields = ['id', 'hotel', 'hotel_name', 'room_number', 'room_type', 'capacity', 'price_per_night', 'amenities']
+        read_only_fields = fields
+
+
+class ReviewSerializer(RowsMixin, SparseFieldsMixin, serializers.ModelSerializer):
  ## Review can be room specific or hotel specific, we need to manage both in our case:
  ##Anyone can see reviews: hotel/1/reviews : or hotel/1/rooms/reviews
     hotel_name = serializers.SerializerMethodField()
@@ -66,20 +198,48 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['comment', 'rating', 'created_at', 'hotel_name']
         read_only_fields = ['created_at']
+        sparse_columns = {'hotel_name': ['hotel__name']}
+        row_values = {'hotel_name': itemgetter('hotel__name')}
 
 
     def get_hotel_name(self, obj):
         return obj.hotel.name
     
-class BookingSerializer(serializers.ModelSerializer):
+class PreloadedRoomField(serializers.PrimaryKeyRelatedField):
+    ## bulk requests fetch every room of the batch once and pass them in context['rooms']
+    def to_internal_value(self, data):
+        rooms = self.context.get('rooms')
+        if rooms is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            room = rooms.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if room is None:
+            self.fail('does_not_exist', pk_value=data)
+        return room
+
+
+class BookingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    room = PreloadedRoomField(queryset=Room.objects.all())
 
     class Meta:
         model = Booking
         fields = ['id','room', 'customer', 'status', 'created_at', 'checked_in_date', 'checked_out_date', 'total_amount']
         read_only_fields = ['id','customer', 'status', 'created_at', 'total_amount']
 
+    def validate(self, data):
+        check_in = data.get('checked_in_date', getattr(self.instance, 'checked_in_date', None))
+        check_out = data.get('checked_out_date', getattr(self.instance, 'checked_out_date', None))
+        if check_in and check_out and check_out <= check_in:
+            raise serializers.ValidationError("checked_out_date must be after checked_in_date")
+
+        return data
+
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = [
@@ -101,4 +261,29 @@ class PaymentSerializer(serializers.ModelSerializer):
 
     
 
-    
\ No newline at end of file
+    
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField(help_text='inclusive')
+    period = serializers.ChoiceField(choices=['day', 'week', 'month'], default='day')
+    source = serializers.ChoiceField(choices=['rollup', 'live'], default='rollup')
+
+    def validate(self, data):
+        if data['end'] < data['start']:
+            raise serializers.ValidationError("end must not be before start")
+        if (data['end'] - data['start']).days > 3 * 366:
+            raise serializers.ValidationError("ranges are limited to three years")
+
+        return data
+
+
+class CalendarQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(default=date.today)
+    days = serializers.IntegerField(default=90, min_value=1, max_value=MAX_CALENDAR_DAYS)
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=MAX_RESULTS)
+    hotel = serializers.IntegerField(required=False, min_value=1)
@@ -0,0 +1,135 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import analytics, cache, inventory, search
+from .authentication import forget_user
+from .models import (
+    User, Hotel, Room, Review, Booking, Payment, RatePlan, StayDiscount, OccupancySurge,
+    bookings_bulk_created, tag_amenities,
+)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def owner_renamed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    ## hotels show their owner's first name as owner_name; users loaded without it did not change it
+    first_name = instance.__dict__.get('first_name')
+    if created or raw or 'first_name' not in instance.__dict__ or (update_fields is not None and 'first_name' not in update_fields):
+        return
+    if getattr(instance, '_first_name_as', None) == first_name:
+        return
+    instance._first_name_as = first_name
+    hotel_ids = list(Hotel.objects.filter(owner=instance).values_list('pk', flat=True))
+    if hotel_ids:
+        cache.touch_on_commit(cache.HOTELS, *(cache.hotel_scope(hotel_id) for hotel_id in hotel_ids))
+
+
+@receiver([post_save, post_delete], sender=Hotel)
+def hotel_changed(sender, instance, **kwargs):
+    cache.touch_on_commit(cache.HOTELS, cache.hotel_scope(instance.pk))
+
+
+@receiver(post_save, sender=Hotel)
+def hotel_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_hotels([instance])
+
+
+@receiver(post_delete, sender=Hotel)
+def hotel_deleted(sender, instance, **kwargs):
+    search.remove_hotels([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Room)
+def room_changed(sender, instance, **kwargs):
+    ## the hotel list shows total_rooms, so it goes stale too
+    cache.touch_on_commit(cache.HOTELS, cache.hotel_scope(instance.hotel_id))
+
+
+@receiver([post_save, post_delete], sender=RatePlan)
+@receiver([post_save, post_delete], sender=StayDiscount)
+@receiver([post_save, post_delete], sender=OccupancySurge)
+def pricing_rule_changed(sender, instance, **kwargs):
+    cache.touch_on_commit(cache.pricing_scope(instance.hotel_id))
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=Room)
+def amenities_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'amenities' not in update_fields):
+        return
+    tag_amenities([instance])
+
+
+def _apply_review(key, delta):
+    hotel_id, room_id, rating = key
+    if hotel_id is None or rating is None:
+        return
+    Hotel.adjust_rating(hotel_id, rating, delta)
+    if room_id is not None:
+        Room.adjust_rating(room_id, rating, delta)
+    ## aggregates are written with UPDATE, which sends no Hotel signals
+    cache.touch_on_commit(cache.HOTELS, cache.hotel_scope(hotel_id))
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_rated_as', None)
+    current = instance._rating_key()
+    if previous == current:
+        return
+    if previous is not None:
+        _apply_review(previous, -1)
+    _apply_review(current, 1)
+    instance._rated_as = current
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    _apply_review(getattr(instance, '_rated_as', instance._rating_key()), -1)
+    search.remove_reviews([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+def review_indexed(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'comment' not in update_fields):
+        return
+    search.index_reviews([instance])
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_stay_as', None)
+    inventory.booking_changed(instance, previous)
+    analytics.record_booking_change(instance, previous)
+    instance._stay_as = instance.stay_key()
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    analytics.record_booking_removed(instance, getattr(instance, '_stay_as', instance.stay_key()))
+
+
+@receiver(bookings_bulk_created, sender=Booking)
+def bookings_created(sender, bookings, **kwargs):
+    inventory.hold(bookings)
+    analytics.record_new_bookings(bookings)
+    for booking in bookings:
+        booking._stay_as = booking.stay_key()
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    was_completed = not created and getattr(instance, '_status_as', None) == 'COMPLETED'
+    is_completed = instance.status == 'COMPLETED'
+    if was_completed != is_completed:
+        analytics.record_payments([(instance.booking_id, instance.amount, 1 if is_completed else -1)])
+    instance._status_as = instance.status
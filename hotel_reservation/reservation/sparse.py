@@ -0,0 +1,125 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+## Sparse fieldsets: ?fields=name,location returns only those fields, ?omit=description every
+## field but that one.
+##
+## Serializers mix in SparseFieldsMixin, which drops the other fields on reads. Views mix in
+## SparseQuerysetMixin, which loads only what the remaining fields read: .only() the columns,
+## select_related() the relations, and the serializer's Meta.sparse_annotations for the fields
+## that need one, so an omitted computed field such as total_rooms costs neither its aggregate
+## nor its join. Fields read from a model column or a chain of foreign keys are worked out from
+## their source; others (SerializerMethodFields, properties) list theirs in Meta.sparse_columns,
+## and a field that is not listed turns column pruning off rather than risk a query per row.
+## Views that set list_rows list straight from .values() rows when the serializer supports
+## it (see rows.py).
+
+
+def _names(params, key):
+    value = params.get(key)
+    return None if value is None else {name.strip() for name in value.split(',') if name.strip()}
+
+
+def select_fields(fields, params):
+    """The ``fields`` mapping narrowed to the ?fields= / ?omit= query parameters."""
+    wanted, omitted = _names(params, 'fields'), _names(params, 'omit')
+    if wanted is None and omitted is None:
+        return fields
+    unknown = ((wanted or set()) | (omitted or set())) - set(fields)
+    if unknown:
+        raise ValidationError({'fields': [f"Unknown fields: {', '.join(sorted(unknown))}"]})
+    return {
+        name: field for name, field in fields.items()
+        if (wanted is None or name in wanted) and (omitted is None or name not in omitted)
+    }
+
+
+class SparseFieldsMixin:
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        ## only the top-level serializer (or each item of a top-level list) is narrowed
+        top_level = self.parent is None or (isinstance(self.parent, ListSerializer) and self.parent.parent is None)
+        if request is None or request.method not in SAFE_METHODS or not top_level:
+            return fields
+        return select_fields(fields, getattr(request, 'query_params', request.GET))
+
+
+def _column(model, source):
+    ## 'hotel.name' -> 'hotel__name', if every step is a concrete field
+    path = source.split('.')
+    for step, name in enumerate(path):
+        field = model._meta.get_field(name)
+        if not field.concrete or (step < len(path) - 1 and not field.is_relation):
+            raise FieldDoesNotExist(name)
+        model = field.related_model
+    return '__'.join(path)
+
+
+def columns_for(serializer):
+    """The columns the serializer's fields read, or None if some field's cannot be worked out."""
+    model = serializer.Meta.model
+    declared = getattr(serializer.Meta, 'sparse_columns', {})
+    columns = set()
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in declared:
+            columns.update(declared[name])
+            continue
+        try:
+            columns.add(_column(model, field.source))
+        except FieldDoesNotExist:
+            return None
+    return columns
+
+
+class SparseQuerysetMixin:
+    ## list from .values() rows instead of model instances, for serializers that can (see rows.py)
+    list_rows = False
+
+    def ordering_columns(self, model):
+        ## the cursor paginator reads the ordering fields off the last row of the page, and the pk
+        ## it breaks their ties with
+        names = [model._meta.pk.name]
+        for ordering in (getattr(self.paginator, 'ordering', ()), getattr(self, 'ordering', None),
+                         getattr(self, 'ordering_fields', None), model._meta.ordering):
+            names.extend([ordering] if isinstance(ordering, str) else ordering or ())
+        columns = set()
+        for name in names:
+            try:
+                columns.add(_column(model, name.lstrip('-')))
+            except FieldDoesNotExist:
+                pass
+        return columns
+
+    def reads_rows(self, serializer):
+        ## every field that is not a column needs a function of the row
+        return set(getattr(serializer.Meta, 'sparse_columns', {})) <= set(getattr(serializer.Meta, 'row_values', {}))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+        annotated = []
+        for name, annotations in getattr(serializer.Meta, 'sparse_annotations', {}).items():
+            if name in serializer.fields:
+                queryset = queryset.annotate(**annotations)
+                annotated.extend(annotations)
+        if self.request.method not in SAFE_METHODS:
+            ## writes save the instance, so they load all of it
+            return queryset
+        columns = columns_for(serializer)
+        if columns is None:
+            return queryset
+        ordering = self.ordering_columns(queryset.model)
+        if self.list_rows and self.action == 'list' and self.reads_rows(serializer):
+            return queryset.values(*(columns | ordering), *annotated)
+        queryset = queryset.select_related(None)
+        relations = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+        if relations:
+            ## with no arguments select_related() would follow every foreign key
+            queryset = queryset.select_related(*relations)
+        return queryset.only('pk', *columns, *ordering)
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+## Refresh-token blacklist with a bloom filter in front of the database.
+##
+## With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION every refresh checks the blacklist,
+## blacklists the old token and records the new one. Almost every token checked is not on the
+## blacklist, so each process keeps a bloom filter of blacklisted jtis: a miss means "not
+## blacklisted" without a query, and only a possible hit is confirmed in the database.
+##
+## Blacklisting bumps the 'token-blacklist' version stamp in the shared cache (see cache.py);
+## a process that sees a new stamp adds the rows blacklisted since its last sync (one indexed
+## query on id). Ids are handed out at insert but become visible at commit, so a lower id can
+## appear after a higher one: the ids skipped over are re-read for TOKEN_BLACKLIST_SYNC_GRACE
+## seconds, until they show up or are taken as rolled back. Like the catalogue cache, several
+## processes need a shared cache backend.
+##
+## The first load reads the whole blacklist, in a background thread by default
+## (TOKEN_BLACKLIST_LOAD = 'thread'); until it is done every check goes to the database.
+## `manage.py prune_tokens` deletes expired tokens, which keeps both tables bounded.
+
+BLACKLIST_SCOPE = 'token-blacklist'
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        ## a key whose bits are all set already (seen before) is not counted again
+        added = False
+        for position in self._positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                self.bits[position >> 3] |= 1 << (position & 7)
+                added = True
+        self.count += added
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """The process-wide bloom filter of blacklisted jtis, kept in step with the database."""
+    ## ids skipped over by more than this are taken as deleted, not as still to commit
+    MAX_GAP = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        ## {id below last_id not seen yet: when it was skipped}
+        self.gaps = {}
+        self.version = None
+        self.loader = None
+
+    def sync(self):
+        """Catch up with the database; False while the first load is still running."""
+        version = cache.versions(BLACKLIST_SCOPE)[0]
+        if self.bloom is not None and version == self.version:
+            return True
+        if self.bloom is None or self.bloom.count > self.bloom.capacity:
+            ## start over, bigger if it has filled up; this also sheds pruned tokens. A full
+            ## filter stays in use meanwhile: it only answers "maybe" more often
+            self.start_load()
+            if self.bloom is None:
+                return False
+        with self.lock:
+            self.last_id, self.gaps = self.read(self.bloom, self.last_id, self.gaps)
+            self.version = version
+        return True
+
+    def start_load(self):
+        if getattr(settings, 'TOKEN_BLACKLIST_LOAD', 'thread') != 'thread':
+            self.load()
+            return
+        with self.lock:
+            if self.loader is None or not self.loader.is_alive():
+                self.loader = threading.Thread(target=self._load_in_thread, name='token-blacklist', daemon=True)
+                self.loader.start()
+
+    def _load_in_thread(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Loading the token blacklist failed; checks keep going to the database")
+        finally:
+            close_old_connections()
+
+    def load(self):
+        ## the stamp is read first, so rows blacklisted during the load are picked up by the next sync
+        version = cache.versions(BLACKLIST_SCOPE)[0]
+        capacity = max(getattr(settings, 'TOKEN_BLACKLIST_CAPACITY', 1_000_000), 2 * self.bloom.count if self.bloom else 0)
+        bloom = BloomFilter(capacity, getattr(settings, 'TOKEN_BLACKLIST_ERROR_RATE', 0.001))
+        last_id, gaps = self.read(bloom, 0, {})
+        with self.lock:
+            self.bloom, self.last_id, self.gaps, self.version = bloom, last_id, gaps, version
+
+    def read(self, bloom, last_id, gaps):
+        ## rows past the watermark, and the ones skipped over that may have committed since
+        now = time.monotonic()
+        floor = min(gaps, default=last_id + 1) - 1
+        rows = BlacklistedToken.objects.filter(id__gt=floor).order_by('id').values_list('id', 'token__jti')
+        for row_id, jti in rows.iterator(chunk_size=10000):
+            bloom.add(jti)
+            if row_id > last_id:
+                gaps.update(dict.fromkeys(range(max(last_id + 1, row_id - self.MAX_GAP), row_id), now))
+                last_id = row_id
+            else:
+                gaps.pop(row_id, None)
+        grace = getattr(settings, 'TOKEN_BLACKLIST_SYNC_GRACE', 60)
+        return last_id, {
+            row_id: skipped for row_id, skipped in gaps.items()
+            if now - skipped < grace and row_id > last_id - self.MAX_GAP
+        }
+
+    def might_contain(self, jti):
+        if not self.sync():
+            return True
+        return jti in self.bloom
+
+    def add(self, jti):
+        if self.sync():
+            with self.lock:
+                self.bloom.add(jti)
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    simplejwt's RefreshToken with the blacklist check behind the bloom filter, and the
+    outstanding/blacklist writes done without the user fetch and get_or_create round trips.
+    """
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if not blacklist_filter.might_contain(jti):
+            return
+        if BlacklistedToken.objects.filter(token__jti=jti).exists():
+            raise TokenError(_("Token is blacklisted"))
+
+    def _outstanding(self):
+        return OutstandingToken(
+            jti=self.payload[api_settings.JTI_CLAIM],
+            user_id=self.payload.get(api_settings.USER_ID_CLAIM),
+            created_at=self.current_time,
+            token=str(self),
+            expires_at=datetime_from_epoch(self.payload['exp']),
+        )
+
+    def outstand(self):
+        ## a fresh jti is not in the table yet; ignore_conflicts keeps a repeated call harmless
+        OutstandingToken.objects.bulk_create([self._outstanding()], ignore_conflicts=True)
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        outstanding = OutstandingToken.objects.filter(jti=jti).values_list('id', flat=True)
+        with transaction.atomic():
+            ## tokens are recorded when issued, so the insert is only for ones issued elsewhere
+            token_id = outstanding.first()
+            if token_id is None:
+                self.outstand()
+                token_id = outstanding.get()
+            BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=token_id)], ignore_conflicts=True)
+            transaction.on_commit(lambda: cache.touch(BLACKLIST_SCOPE))
+        blacklist_filter.add(jti)
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+def prune_expired(batch_size=10000):
+    """Delete expired outstanding tokens, and with them their blacklist rows, in batches."""
+    deleted = 0
+    expired = OutstandingToken.objects.filter(expires_at__lt=timezone.now()).order_by()
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        ## the blacklist rows go with them in one cascaded DELETE
+        OutstandingToken.objects.filter(id__in=ids).only('id').delete()
+        deleted += len(ids)
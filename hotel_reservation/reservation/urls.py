@@ -1,5 +1,7 @@
 from django.urls import path, include
-from .views import UserCreateView, HotelView, RoomView, ReviewView, BookingView, PaymentView, callback_esewa
+from .views import UserCreateView, HotelView, RoomView, ReviewView, BookingView, PaymentView, RoomAvailabilityView, ExportView, HotelAnalyticsView, QuoteView, SearchView, callback_esewa
+from . import async_views
+from .metrics import metrics_view
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedDefaultRouter
 router = DefaultRouter()
@@ -13,10 +15,25 @@ booking_router.register('payments', PaymentView, basename='booking-payments')
 
 urlpatterns = [
     path('create-user/', UserCreateView.as_view(), name='create-user'),
+    path('rooms/available/', RoomAvailabilityView.as_view(), name='rooms-available'),
     path('', include(router.urls)),
     path('', include(hotels_router.urls)),
     path('', include(booking_router.urls)),
-    path('esewa/callback/', callback_esewa, name='esewa-callback')
+    path('metrics/', metrics_view, name='metrics'),
+    path('quotes/', QuoteView.as_view(), name='quotes'),
+    path('search/hotels/', SearchView.as_view(target='hotels'), name='search-hotels'),
+    path('search/reviews/', SearchView.as_view(target='reviews'), name='search-reviews'),
+    path('esewa/callback/', callback_esewa, name='esewa-callback'),
+    path('exports/bookings/', ExportView.as_view(export='bookings'), name='export-bookings'),
+    path('exports/payments/', ExportView.as_view(export='payments'), name='export-payments'),
+    path('analytics/hotels/<int:pk>/', HotelAnalyticsView.as_view(), name='hotel-analytics'),
+    path('analytics/hotels/<int:pk>/rooms/', HotelAnalyticsView.as_view(rooms=True), name='hotel-room-analytics'),
+    ## async read-only catalogue, served by asgi.py
+    path('async/hotels/', async_views.hotel_list, name='async-hotel-list'),
+    path('async/hotels/<int:pk>/', async_views.hotel_detail, name='async-hotel-detail'),
+    path('async/hotels/<int:hotel_pk>/rooms/', async_views.room_list, name='async-hotel-rooms-list'),
+    path('async/hotels/<int:hotel_pk>/reviews/', async_views.review_list, name='async-hotel-reviews-list'),
+    path('async/hotels/<int:hotel_pk>/reviews/<int:pk>/', async_views.review_detail, name='async-hotel-reviews-detail'),
 ]
 
 